@@ -0,0 +1,154 @@
+from requests.adapters import HTTPAdapter
+import random
+import threading
+import time
+import requests
+
+############################################################################################
+# POKEMON TCG API CLIENT
+#
+# Every request to the Pokemon TCG API goes through one shared client so that:
+# - connections are kept alive and reused (no new TCP/TLS handshake per request)
+# - a hanging API can't hang a gunicorn worker (connect/read timeouts)
+# - short hiccups are retried with jittered backoff
+# - when the API is down, requests fail fast (circuit breaker) and pages fall back to local data
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """The Pokemon TCG API could not be reached or returned an error."""
+
+
+class CardNotFound(UpstreamError):
+    """The Pokemon TCG API has no card with the requested id."""
+
+
+class CircuitOpen(UpstreamError):
+    """The Pokemon TCG API has been failing, so it isn't being called for now."""
+
+
+class CircuitBreaker:
+    """Stop calling the API after `failure_threshold` failures in a row.
+
+    Once `reset_seconds` have passed, a single trial request is let through:
+    if it succeeds the circuit closes again, otherwise it stays open for another period.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """Return True if a request may be sent to the API right now."""
+
+        with self._lock:
+            if self.opened_at is None:
+                return True
+
+            if not self._trial_running and self.clock() - self.opened_at >= self.reset_seconds:
+                self._trial_running = True
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+class PokemonTCGClient:
+    """Pooled, resilient HTTP client for the Pokemon TCG API."""
+
+    def __init__(self, base_url, api_key=None, connect_timeout=3.05, read_timeout=5, retries=2, backoff=0.25,
+                 pool_size=10, breaker=None, session=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # an API key raises the rate limit, but the API works without one
+        if api_key:
+            self.session.headers['X-Api-Key'] = api_key
+
+    def get(self, path='', params=None):
+        """Return the decoded JSON response for `path` (relative to the base url).
+
+        Raises CardNotFound on a 404, CircuitOpen if the API is being skipped,
+        and UpstreamError if the API still fails after retrying.
+        """
+
+        if not self.breaker.allow():
+            raise CircuitOpen("The Pokemon TCG API is unavailable.")
+
+        url = f'{self.base_url}/{path}' if path else self.base_url
+        error = None
+        answered = False
+
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    # full jitter so retries from many workers don't arrive at the same moment
+                    time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+                try:
+                    response = self.session.get(url, params=params, timeout=self.timeout)
+                except requests.RequestException as e:
+                    # connection errors and timeouts, but also cut off or undecodable bodies, redirect loops...
+                    error = e
+                    continue
+
+                if response.status_code in RETRY_STATUSES:
+                    error = UpstreamError(f"Pokemon TCG API returned {response.status_code}")
+                    continue
+
+                if response.status_code < 400:
+                    try:
+                        data = response.json()
+                    except ValueError as e: # the body isn't JSON
+                        error = e
+                        continue
+
+                # the API answered, so it is healthy even if the request itself was bad
+                answered = True
+                self.breaker.record_success()
+
+                if response.status_code == 404:
+                    raise CardNotFound(url)
+                if response.status_code >= 400:
+                    raise UpstreamError(f"Pokemon TCG API returned {response.status_code}")
+
+                return data
+
+        finally:
+            # also on unexpected errors, so a failed half-open trial can't leave the circuit stuck open
+            if not answered:
+                self.breaker.record_failure()
+
+        raise UpstreamError(f"Pokemon TCG API request failed: {error}") from error
@@ -1,76 +1,347 @@
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import Flask, Blueprint, render_template, request, flash, redirect, session, g, current_app, has_app_context, jsonify, url_for, abort
 from sqlalchemy.exc import IntegrityError
-from models import db, connect_db, User, Card, Favorite
+from models import db, connect_db, User, Favorite
 from forms import AddUserForm, LoginForm, EditUserForm
-import requests
+from cache import TTLCache, MISSING
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from featured import FeaturedCards
+from prefetch import Prefetcher
+from api_client import PokemonTCGClient, UpstreamError, CardNotFound
+from records import CardRecord
+from config import CONFIGS, database_uri, default_config
+import catalog
+import metrics
+import queries
+import rendering
+import images
+from passwords import PasswordHasherBusy
 import os
 import re
+import secrets
 
-app = Flask(__name__)
+# every page of the site; registered on the app by create_app() below
+views = Blueprint('views', __name__)
 
-uri = os.environ.get('DATABASE_URL', 'postgresql:///pokemon_tcg')
-if uri.startswith("postgres://"):
-    uri = uri.replace("postgres://", "postgresql://", 1)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = uri
+def create_app(config=None):
+    """Build the app with `config` (a config class or its name in config.CONFIGS).
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False 
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+    Used by gunicorn (see the Procfile) and `flask run`. `from app import app` builds one with the default config.
+    Each app gets its own background workers (in `app.extensions`), so several apps (e.g. in tests)
+    don't take over each other's database writes and refreshes.
+    """
+
+    app = Flask(__name__)
+    app.config.from_object(config if isinstance(config, type) else CONFIGS[config or default_config()])
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', database_uri())
+
+    # Server-Timing header on every response and /metrics (see metrics.py)
+    metrics.init_app(app)
+    queries.init_app(app)
+    rendering.init_app(app)
+    images.init_app(app)
+
+    # the debug toolbar (and its imports) is only loaded in development
+    if app.config['DEBUG_TB_ENABLED']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+
+    init_background_work(app)
+
+    app.register_blueprint(views)
+    app.teardown_appcontext(shutdown_session)
+
+    return app
+
+
+def init_background_work(app):
+    """Create the objects which work for `app` outside of its requests."""
+
+    # cards shown on the homepage, refreshed in the background (see featured.py)
+    app.extensions['featured_cards'] = FeaturedCards(api, app)
+
+    # cards requested from the API are saved to the local catalog in batches (see catalog.py)
+    card_writer = app.extensions['card_writer'] = catalog.CardWriteBuffer(app)
+
+    # stored cards not synced for a day are requested again in the background, for their prices (see catalog.py)
+    app.extensions['card_refresher'] = catalog.CardRefresher(fetch_card_details, card_writer,
+                                                             on_refresh=lambda card: card_cache.set(card.id, card))
 
-connect_db(app)
+    # the details of the first few cards of each search are warmed once the results are sent (see prefetch.py)
+    app.extensions['prefetcher'] = Prefetcher(card_cache, request_individual_card_details, app)
+
+
+def __getattr__(name):
+    # `from app import app` (tests, seed.py, sync.py) builds the app on first use
+    if name == 'app':
+        app = globals()['app'] = create_app()
+
+        # scripts and tests use the database outside of an app context with this app
+        db.app = app
+        return app
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 ############################################################################################
 
-API_BASE_URL = 'https://api.pokemontcg.io/v2/cards'
+# can be pointed at a stand-in API (e.g. benchmark/fake_api.py)
+API_BASE_URL = os.environ.get('POKEMON_TCG_API_URL', 'https://api.pokemontcg.io/v2/cards')
+
+# shared client for all Pokemon TCG API requests: pooled connections, timeouts, retries and a circuit breaker
+# (gevent workers, see gunicorn.conf.py, run many requests per process, so keep enough connections open for them)
+api = PokemonTCGClient(API_BASE_URL, api_key=os.environ.get('POKEMON_TCG_API_KEY'),
+                       pool_size=int(os.environ.get('API_POOL_SIZE', 50)))
+metrics.instrument_session(api.session)
+
+API_UNAVAILABLE_MESSAGE = "The card database is not responding right now. Please try again in a few minutes."
+
+# in-memory caches of card records (see records.py), keyed by the normalized search term / card id
+# card data rarely changes (market prices are only updated daily), so entries can live for a while
+search_cache = TTLCache('search', max_entries=512, max_bytes=64 * 1024 * 1024, ttl=10 * 60, stale_ttl=5 * 60)
+card_cache = TTLCache('card', max_entries=4096, max_bytes=64 * 1024 * 1024, ttl=60 * 60, stale_ttl=10 * 60)
+
+# card ids that don't exist and searches without results are remembered for a short time,
+# so bad links and bots can't send the same request upstream over and over
+NEGATIVE_CACHE_TTL = 2 * 60
+
+# suggestions for the search box, repeated keystrokes are answered from memory
+autocomplete_cache = TTLCache('autocomplete', max_entries=2048, max_bytes=4 * 1024 * 1024, ttl=10 * 60, stale_ttl=0)
+
+# the ids of each user's favorite cards, keyed by (user id, favorites version in their session)
+# toggling a favorite gives that session a new version, so every worker sees the change right away
+# in the session which made it. The version isn't shared between sessions: the user's other
+# browsers and devices may see the old favorites until their entry expires (after a minute)
+favorite_ids_cache = TTLCache('favorite_ids', max_entries=4096, max_bytes=16 * 1024 * 1024, ttl=60, stale_ttl=0)
+
+metrics.add_cache_metrics(search_cache, card_cache, autocomplete_cache, favorite_ids_cache)
+
+# database pool size/usage at /metrics (see db_pool.py)
+metrics.add_pool_metrics(db)
+
+# card names can contain more than letters: 'Mr. Mime', 'Porygon-Z', "Farfetch'd", 'Nidoran ♀', 'Porygon2'
+# (at least one letter is required)
+SEARCH_PATTERN = re.compile(r"(?=.*[^\W\d_])[\w .'\-♀♂]+")
+
+# card ids look like 'swsh4-44', 'swshp-SWSH020' or 'swsh12pt5-160'
+CARD_ID_PATTERN = re.compile(r'[\w.-]+')
+
+# number of cards on each page of search results
+SEARCH_PAGE_SIZE = 24
+
+# batched lookups (user favorites) combine this many ids into one `id:` query
+# and run at most this many of those queries at the same time
+CARD_BATCH_SIZE = 50
+CARD_BATCH_WORKERS = 4
 
 ############################################################################################
 # POKEMON TCG API REQUEST FUNCTIONS - GET CARDS AND CARD DETAILS
 
-def request_cards(pokemon):
-    """Return the dictionary containing the Pokemon card info"""
+def in_app_context(func):
+    """Return `func` bound to the current app: it gets that app's context if there isn't one
+    when it runs (e.g. when a cache refreshes a stale entry in a background thread)."""
+
+    app = current_app._get_current_object()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if has_app_context():
+            return func(*args, **kwargs)
+
+        with app.app_context():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@metrics.timed('cards')
+def request_cards(pokemon, page=1):
+    """Return the dictionary containing one page of the Pokemon card info
+
+    {"data": [CardRecord, ...], "page": 1, "pageSize": 24, "totalCount": 120, "source": "catalog"}
+    """
+
+    pokemon = pokemon.strip().lower()
+
+    load = in_app_context(load_cards)
+
+    return search_cache.get_or_load((pokemon, page), lambda: load(pokemon, page), ttl=search_ttl)
+
+
+def search_ttl(result):
+    """Cache searches without results for a shorter time (the default ttl is used for the rest)"""
+
+    return NEGATIVE_CACHE_TTL if not result['totalCount'] else None
+
+
+def load_cards(pokemon, page):
+    """Search the local card catalog, falling back to the API if it hasn't been synced"""
+
+    result = catalog.search_cards(pokemon, page, SEARCH_PAGE_SIZE)
+
+    if result is None:
+        return fetch_cards(pokemon, page)
+
+    cards, total = result
+    return {"data": cards, "page": page, "pageSize": SEARCH_PAGE_SIZE, "totalCount": total, "source": "catalog"}
+
+
+def fetch_cards(pokemon, page=1):
+    """Make the API request for one page of cards matching `pokemon` (bypasses the cache)"""
 
-    url = f'{API_BASE_URL}/?q=name:{pokemon}'
-    response = requests.get(url)
-    data = response.json()
+    # names with spaces have to be quoted in the API query
+    name = f'"{pokemon}"' if ' ' in pokemon else pokemon
+    data = api.get(params={"q": f'name:{name}', "page": page, "pageSize": SEARCH_PAGE_SIZE})
 
-    data = data['data']
-  
-    return {"data": data}
+    cards = [CardRecord.from_api(card) for card in data['data']]
 
+    return {"data": cards, "page": page, "pageSize": SEARCH_PAGE_SIZE, "totalCount": data['totalCount'], "source": "api"}
 
+
+def is_valid_search(pokemon):
+    """Return True if `pokemon` only contains characters which can appear in a card name"""
+
+    return bool(pokemon) and SEARCH_PATTERN.fullmatch(pokemon.strip()) is not None
+
+
+@metrics.timed('cards')
 def request_individual_card_details(pokemon_id):
-    """ Return dictionary containing an individual card's details """
+    """ Return the CardRecord containing an individual card's details """
+
+    pokemon_id = pokemon_id.strip()
+
+    # ids which can't be a card id would only make the API respond with an error
+    if not CARD_ID_PATTERN.fullmatch(pokemon_id):
+        raise CardNotFound(pokemon_id)
+
+    load = in_app_context(load_card_details)
+
+    return card_cache.get_or_load(pokemon_id, lambda: load(pokemon_id),
+                                  errors=(CardNotFound,), error_ttl=NEGATIVE_CACHE_TTL)
+
+
+def load_card_details(pokemon_id):
+    """Read a card from the local catalog. On a miss, request it from the API and save it locally.
+
+    Cards stored more than a day ago are refreshed from the API in the background.
+    """
+
+    # the full payload is only kept until it is saved, the cache holds the compact record
+    card_writer = current_app.extensions['card_writer']
+
+    data = card_writer.get(pokemon_id)
+    if data is not None:
+        return CardRecord.from_api(data)
+
+    card = catalog.get_card(pokemon_id, refresh=current_app.extensions['card_refresher'].refresh)
+
+    if card is None:
+        data = fetch_card_details(pokemon_id)
+        card_writer.add(data) # saved in the background, the page doesn't wait on the commit
+        card = CardRecord.from_api(data)
+
+    return card
+
+
+def fetch_card_details(pokemon_id):
+    """Make the API request for an individual card's details (bypasses the cache)"""
+
+    data = api.get(pokemon_id)
+
+    # the full payload, which is saved to the local catalog
+    return data['data']
+
+
+@metrics.timed('cards')
+def request_cards_by_ids(card_ids):
+    """Return a list of CardRecords for `card_ids`, in the same order.
+
+    Cards already in the cache or the local catalog are used as-is. The rest are looked up with combined
+    `(id:a OR id:b ...)` queries which run concurrently on a small thread pool.
+    Cards that fail to load are left out so the page can still be rendered.
+    """
 
-    url= f'{API_BASE_URL}/{pokemon_id}'
-    response = requests.get(url)
-    data = response.json()
+    found = {}
+    missing = []
 
-    # this data will be used for HTML template
-    data = data['data']
+    for card_id in card_ids:
+        data = card_cache.get(card_id)
+        if data is MISSING:
+            missing.append(card_id)
+        else:
+            found[card_id] = data
 
-    return {"data": data}
+    # then the local catalog, and only request what is still missing from the API
+    if missing:
+        found.update(catalog.get_cards(missing))
+        missing = [card_id for card_id in missing if card_id not in found]
+
+    batches = [missing[i:i + CARD_BATCH_SIZE] for i in range(0, len(missing), CARD_BATCH_SIZE)]
+
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(CARD_BATCH_WORKERS, len(batches))) as pool:
+            futures = [pool.submit(fetch_cards_by_ids, batch) for batch in batches]
+
+            for future in futures:
+                try:
+                    cards = future.result()
+                except Exception:
+                    continue # skip this batch, the rest of the favorites will still be shown
+
+                for data in cards:
+                    current_app.extensions['card_writer'].add(data)
+                    card = CardRecord.from_api(data)
+                    card_cache.set(card.id, card)
+                    found[card.id] = card
+
+    return [found[card_id] for card_id in card_ids if card_id in found]
+
+
+def fetch_cards_by_ids(card_ids):
+    """Make one API request for every card in `card_ids` (bypasses the cache). Returns the full payloads."""
+
+    query = ' OR '.join(f'id:"{card_id}"' for card_id in card_ids)
+    data = api.get(params={'q': f'({query})', 'pageSize': len(card_ids)})
+
+    return data['data']
 
 ############################################################################################
 # POKEMON TCG API REQUEST ROUTES - CARDS
 
-@app.route('/cards')
+@views.route('/cards')
 def get_pokemon_cards():
     """Handle form submission; return form; show cards related to search query"""
 
     try:
         pokemon = request.args.get('pokemon-search') # gets search form input
+        page = max(request.args.get('page', 1, type=int), 1)
 
-        if not str.isalpha(pokemon): # checks each character in the input to see if it is a valid characher in alphabet 
+        if pokemon is None: # nothing was submitted, handled below
+            raise ValueError("no search")
+
+        if not is_valid_search(pokemon): # checks each character in the input to see if it can be part of a card name
             flash("Invalid characters in search. Please try something else.", "danger")
             return redirect("/")
 
-        card = request_cards(pokemon) # if search is valid, it will run the function defined above to make the API request
+        card = request_cards(pokemon, page) # if search is valid, it will run the function defined above to make the API request
+        last_page = max((card['totalCount'] + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE, 1)
+
+        # browsers which already have this page of results get a 304
+        etag_parts = (pokemon, page, card['totalCount'], tuple(rendering.card_version(result) for result in card['data']))
+
+        response = rendering.conditional_page(etag_parts, lambda: render_template(
+            'card/cards.html', cards = card, pokemon = pokemon, page = page, last_page = last_page))
 
-        return render_template('card/cards.html', cards = card, pokemon = pokemon)
+        # the first few cards are likely to be clicked next
+        response.call_on_close(prefetch_details(card))
+
+        return response
+
+    except UpstreamError:
+        flash(API_UNAVAILABLE_MESSAGE, "warning")
+        return redirect("/")
     
     except:
         flash("Invalid search. Can not search nothing.", "danger") 
@@ -78,34 +349,90 @@ def get_pokemon_cards():
 
 
 
-@app.route('/cards/<id>')
+@views.route('/api/cards')
+def get_pokemon_cards_json():
+    """Return one page of search results as JSON (used for infinite scrolling)"""
+
+    pokemon = request.args.get('pokemon-search', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    if not is_valid_search(pokemon):
+        return jsonify(error="Invalid search."), 400
+
+    try:
+        result = request_cards(pokemon, page)
+    except UpstreamError:
+        return jsonify(error=API_UNAVAILABLE_MESSAGE), 503
+
+    has_next = page * SEARCH_PAGE_SIZE < result['totalCount']
+
+    response = jsonify(
+        data=[{"id": card.id, "name": card.name, "images": {"small": card.image_small}} for card in result['data']],
+        page=page,
+        pageSize=SEARCH_PAGE_SIZE,
+        totalCount=result['totalCount'],
+        next=url_for('.get_pokemon_cards_json', **{'pokemon-search': pokemon, 'page': page + 1}) if has_next else None,
+    )
+    response.call_on_close(prefetch_details(result))
+
+    return response
+
+
+def prefetch_details(result):
+    """Return a function which warms the details of the first cards of a page of search results
+    (see prefetch.py). It runs once the response is sent, after the request's app context is gone."""
+
+    prefetcher = current_app.extensions['prefetcher']
+
+    return lambda: prefetcher.schedule(result['data'], from_catalog=result.get('source') == 'catalog')
+
+
+
+@views.route('/api/autocomplete')
+def autocomplete():
+    """Return card names matching what has been typed into the search box so far"""
+
+    text = request.args.get('q', '').strip().lower()
+
+    # one letter matches too much to be useful
+    if len(text) < 2 or not is_valid_search(text):
+        return jsonify(suggestions=[])
+
+    suggestions = autocomplete_cache.get_or_load(text, lambda: catalog.suggest_names(text))
+
+    return jsonify(suggestions=suggestions)
+
+
+
+@views.route('/cards/<id>')
 def get_card_details(id):
     """Display details for an individual card"""
 
     try:
-        data = request_individual_card_details(id)
-    
-        # card data will be added to database when user clicks into an individual card
-        card_id = data['data']['id']
-        card_name = data['data']['name']
+        # cards are read from the local catalog; a card requested from the API is saved there
+        card = request_individual_card_details(id)
 
-        # checks if the current card has already been added to the database
-        check_card = Card.query.get(card_id)
-        
-        # If it has not been added, add it. 
-        if not check_card:
-            add_card = Card(id = card_id, name=card_name)
-            
-            db.session.add(add_card)
-            db.session.commit() 
+        card_version = rendering.card_version(card)
 
         # if the user is logged in, they should be able to add/remove favorites. 
         if g.user:
-            favorite_cards = [favorite.id for favorite in g.user.favorites]
-            return render_template('card/card_detail.html', card = data, favorites = favorite_cards)
-            
-    
-        return render_template('card/card_detail.html', card = data)
+            favorited = is_favorite(card.id)
+            etag_parts = (card_version, favorited)
+        else:
+            favorited = False
+            etag_parts = (card_version,)
+
+        # the card details are the same for everyone, so they are rendered once and cached
+        return rendering.conditional_page(etag_parts, lambda: render_template(
+            'card/card_detail.html', card = card, card_details = rendering.render_card_details(card), is_favorite = favorited))
+
+    except CardNotFound:
+        flash("Invalid search. Please try something else", "danger")
+        return redirect('/')
+
+    except UpstreamError:
+        flash(API_UNAVAILABLE_MESSAGE, "warning")
+        return redirect('/')
     
     except:
         flash("Invalid search. Please try something else", "danger")
@@ -114,7 +441,7 @@ def get_card_details(id):
 ############################################################################################
 # HOMEPAGE ROUTES
 
-@app.route('/')
+@views.route('/')
 def homepage():
     """Show homepage:
 
@@ -122,18 +449,8 @@ def homepage():
     - logged in: show main search page
     """
 
-    url = f'{API_BASE_URL}/?q=name:m' # query cards with 'm' in their name to display on homepage
-    response = requests.get(url)
-    data = response.json()
-
-    # data for specific cards which will be displayed on homepage
-    one = data['data'][0]
-    two = data['data'][1]
-    three = data['data'][4]
-    four = data['data'][5]
-    five = data['data'][9]
-
-    cards = {"card1": one}, {"card2": two}, {"card3": three}, {"card4": four}, {"card5": five}
+    # served from the precomputed snapshot, no API request needed
+    cards = current_app.extensions['featured_cards'].get()
 
     return render_template('home.html', cards=cards, isIndex=True)
 
@@ -141,34 +458,98 @@ def homepage():
 # USER SESSION 
 
 CURR_USER_KEY = "current_user"
- 
-@app.before_request   # This function is run before each request. 
+IDENTITY_KEY = "current_user_identity"
+FAVORITES_VERSION_KEY = "favorites_version"
+
+
+class CurrentUser:
+    """The logged in user's identity, as stored in the (signed) session cookie.
+
+    Enough for most pages (the navbar, ETags, favorites). Routes which need the whole
+    `User` row (e.g. to edit it) call `load()`, which is the only time it is queried.
+    """
+
+    __slots__ = ('id', 'username', 'profile_image', '_user')
+
+    def __init__(self, id, username, profile_image, user=None):
+        self.id = id
+        self.username = username
+        self.profile_image = profile_image
+        self._user = user
+
+    def load(self):
+        """Return the full User row (queried on the first call)."""
+
+        if self._user is None:
+            self._user = User.query.get(self.id)
+
+        return self._user
+
+
+@views.before_app_request   # This function is run before each request. 
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
-        # if there is currently a logged in user, query that user 
-        # A common use for 'g' is to manage resources during a request. The g name stands for “global”, but that is referring to the data being global within a context.
-        # Use the session or a database to store data across requests. The application context is a good place to store common data during a request.
+        identity = session.get(IDENTITY_KEY)
+
+        # the identity is saved in the session at login, so most requests don't query the user at all
+        if identity and identity['id'] == session[CURR_USER_KEY]:
+            g.user = CurrentUser(**identity)
+            return
+
+        # sessions from before identities were saved (or only holding the user id)
+        user = User.query.get(session[CURR_USER_KEY])
+        if user is None:
+            do_logout()
+            g.user = None
+            return
+
+        remember_user(user)
+        g.user = CurrentUser(user.id, user.username, user.profile_image, user=user)
     else:
         g.user = None
 
+def load_current_user():
+    """Return the logged in user's full User row.
+
+    The user may have been deleted since the session was saved (e.g. from another device):
+    then they are logged out and None is returned.
+    """
+
+    user = g.user.load()
+
+    if user is None:
+        do_logout()
+        g.user = None
+
+    return user
+
+def remember_user(user):
+    """Save the user's identity in the session (again after it changes, e.g. a new username)."""
+
+    session[IDENTITY_KEY] = {"id": user.id, "username": user.username, "profile_image": user.profile_image}
+
 def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    session[FAVORITES_VERSION_KEY] = secrets.token_hex(4)
+    remember_user(user)
 
 def do_logout():
     """Logout user."""
 
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
+
+    session.pop(IDENTITY_KEY, None)
+    session.pop(FAVORITES_VERSION_KEY, None)
     
 ############################################################################################
 # SIGNUP/LOGIN/LOGOUT ROUTES
 
-@app.route('/signup', methods=["GET", "POST"])
+@views.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -206,7 +587,7 @@ def signup():
         return render_template('user/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@views.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
@@ -221,6 +602,7 @@ def login():
                                  form.password.data)
 
         if user:
+            db.session.commit() # saves the password hash if it was upgraded to the current work factor
             do_login(user)
             flash(f"Welcome back, {user.username}!", "success")
             return redirect("/")
@@ -230,7 +612,7 @@ def login():
     return render_template('user/login.html', form=form)
 
 
-@app.route('/logout')
+@views.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -246,7 +628,7 @@ def logout():
 ############################################################################################
 # USER ROUTES 
 
-@app.route('/user')
+@views.route('/user')
 def show_user_profile():
     """Show user profile."""
 
@@ -254,12 +636,17 @@ def show_user_profile():
         flash("You need to log in or sign up for an account.", "danger")
         return redirect("/")
 
-    user_favorites = [request_individual_card_details(cards.id)['data'] for cards in g.user.favorites]
+    # fetched in a few batched requests instead of one request per favorite
+    favorite_ids = get_favorite_ids().ids
+    user_favorites = request_cards_by_ids(favorite_ids)
+
+    if len(user_favorites) < len(favorite_ids):
+        flash("Some of your favorites could not be loaded right now.", "warning")
 
-    return render_template('user/favorites.html', favorites = user_favorites)
+    return render_template('user/favorites.html', favorites = user_favorites, favorite_count = len(favorite_ids))
 
 
-@app.route('/user/edit', methods=["GET", "POST"])
+@views.route('/user/edit', methods=["GET", "POST"])
 def edit_profile():
     """Update profile details for current user."""
 
@@ -267,7 +654,11 @@ def edit_profile():
         flash("Access unauthorized.", "danger")
         return redirect('/')
 
-    user = g.user
+    user = load_current_user()
+    if user is None:
+        flash("Access unauthorized.", "danger")
+        return redirect('/')
+
     form = EditUserForm(obj=user)
 
     if form.validate_on_submit():
@@ -278,6 +669,7 @@ def edit_profile():
             user.profile_image = form.profile_image.data or User.profile_image.default.arg
 
             db.session.commit()
+            remember_user(user) # the navbar shows the new username/image
 
             flash("Profile successfully updated.", "success")
 
@@ -285,10 +677,10 @@ def edit_profile():
         
         flash("Wrong password, please try again.", 'danger')
 
-    return render_template('user/edit_user.html', form=form, user_id=user.id)
+    return render_template('user/edit_user.html', form=form, user_id=user.id, favorite_count=len(get_favorite_ids()))
 
 
-@app.route('/user/delete', methods=["POST"])
+@views.route('/user/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -296,9 +688,14 @@ def delete_user():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    user = load_current_user()
+    if user is None:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
     do_logout()
 
-    db.session.delete(g.user)
+    db.session.delete(user)
     db.session.commit()
 
 
@@ -308,46 +705,141 @@ def delete_user():
 ############################################################################################
 # FAVORITE ROUTES 
 
-@app.route('/cards/<card_id>/favorite', methods=['POST'])
+FAVORITE_UNAVAILABLE_MESSAGE = "Favorites can't be saved right now. Please try again in a moment."
+
+
+@views.route('/cards/<card_id>/favorite', methods=['POST'])
 def favorite_card(card_id):
     """Adds/Removes like from a card"""
 
     if not g.user:
         flash('Please login to favorite a card.', 'danger')
         return redirect('/')
-    
-    # query the card to see if it is in the 'favorites' table (meaning it has been favorited)
-    favorited_card = Card.query.get_or_404(card_id)
-    # get the user's favorites
-    user_favorites = g.user.favorites
-
-    if favorited_card in user_favorites:
-        g.user.favorites = [favorite for favorite in user_favorites if favorite != favorited_card]
-    else: 
-        g.user.favorites.append(favorited_card)
-    
-    db.session.commit()
 
-    return redirect(request.referrer)
-    # return redirect('/') ---> this redirect is used for unit testing
+    try:
+        favorited = toggle_favorite(card_id)
+    except catalog.CatalogWriteError:
+        flash(FAVORITE_UNAVAILABLE_MESSAGE, "warning")
+        return redirect(request.referrer or '/')
+
+    if favorited is None:
+        abort(404)
+
+    return redirect(request.referrer or '/')
+
+
+@views.route('/api/cards/<card_id>/favorite', methods=['POST'])
+def favorite_card_json(card_id):
+    """Adds/Removes like from a card and returns the new state as JSON (used by the favorite button)"""
+
+    if not g.user:
+        return jsonify(error="Please login to favorite a card."), 401
+
+    try:
+        favorited = toggle_favorite(card_id)
+    except catalog.CatalogWriteError:
+        return jsonify(error=FAVORITE_UNAVAILABLE_MESSAGE), 503
+
+    if favorited is None:
+        return jsonify(error="Card not found."), 404
+
+    return jsonify(card_id=card_id, favorited=favorited)
+
+
+def toggle_favorite(card_id):
+    """Add/remove the card from the current user's favorites. Returns True if it is now a favorite.
+
+    Returns None if the card doesn't exist, and raises catalog.CatalogWriteError if it
+    couldn't be saved to the 'cards' table.
+    """
+
+    # the card may still be waiting to be saved to the 'cards' table
+    try:
+        current_app.extensions['card_writer'].flush(card_id)
+    except catalog.CatalogWriteError:
+        db.session.rollback()
+        raise
+
+    try:
+        favorited = Favorite.toggle(g.user.id, card_id)
+        db.session.commit()
+
+    except IntegrityError:
+        # the card isn't in the 'cards' table
+        db.session.rollback()
+        return None
+
+    # the cached favorite ids are out of date
+    favorite_ids_cache.delete(favorites_cache_key())
+    session[FAVORITES_VERSION_KEY] = secrets.token_hex(4)
+
+    return favorited
+
+
+class FavoriteIds:
+    """A user's favorite card ids, in the order they were added, with a set for membership checks."""
+
+    __slots__ = ('ids', '_lookup')
+
+    def __init__(self, ids):
+        self.ids = tuple(ids)
+        self._lookup = frozenset(self.ids)
+
+    def __contains__(self, card_id):
+        return card_id in self._lookup
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def favorites_cache_key():
+    return (g.user.id, session.get(FAVORITES_VERSION_KEY))
+
+
+def get_favorite_ids():
+    """Return the current user's FavoriteIds (cached until they toggle a favorite)."""
+
+    user_id = g.user.id
+
+    return favorite_ids_cache.get_or_load(favorites_cache_key(), lambda: FavoriteIds(Favorite.card_ids(user_id)))
+
+
+def is_favorite(card_id):
+    """Return True if the card is one of the current user's favorites.
+
+    Uses the cached favorite ids if they are loaded, otherwise looks up the single favorites row.
+    """
+
+    favorite_ids = favorite_ids_cache.get(favorites_cache_key())
+
+    if favorite_ids is MISSING:
+        return Favorite.exists(g.user.id, card_id)
+
+    return card_id in favorite_ids
 
 ############################################################################################
 # ERROR HANDLERS
 
-@app.errorhandler(404)
+@views.app_errorhandler(404)
 def page_not_found(e):
     return render_template('error_handlers/404.html'), 404
 
-@app.errorhandler(405)
+@views.app_errorhandler(405)
 def method_not_allowed(e):
     return render_template('error_handlers/405.html'), 405
 
+@views.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    # too many signups/logins are being processed at once, ask the user to try again
+    db.session.rollback()
+    flash("Too many people are logging in right now. Please try again in a moment.", "warning")
+    return redirect(request.path)
+
 ############################################################################################
 # Fix for error ---> sqlalchemy.exc.TimeoutError: QueuePool limit of size 5 overflow 10 reached, connection timed out, timeout 30.00 (Background on this error at: https://sqlalche.me/e/14/3o7r)
 # https://stackoverflow.com/questions/24956894/sql-alchemy-queuepool-limit-overflow
 # https://stackoverflow.com/questions/57844921/good-practice-to-avoid-sqlalchemy-exc-timeouterror-queuepool-limit-of-size-5-ov
 
-@app.teardown_appcontext
 def shutdown_session(exception=None):
     db.session.remove()
 ############################################################################################
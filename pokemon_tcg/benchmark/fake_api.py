@@ -0,0 +1,151 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import threading
+import time
+
+############################################################################################
+# FAKE POKEMON TCG API
+#
+# Local stand-in for https://api.pokemontcg.io/v2/cards used by the benchmark, so load tests
+# don't depend on (or hammer) the real API. Serves the recorded cards in fixtures/cards.json,
+# optionally cloned into a bigger catalog, with configurable latency and failure rate.
+#
+# Supports the queries the app makes:
+#   /v2/cards/<id>
+#   /v2/cards?q=name:pikachu | name:"mr. mime" | (id:"a" OR id:"b") &page=1&pageSize=24
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'cards.json')
+
+
+def load_fixtures(total=None):
+    """Return the recorded cards, cloned with new ids until there are `total` of them."""
+
+    with open(FIXTURES_PATH) as f:
+        cards = json.load(f)
+
+    if total and total > len(cards):
+        recorded = list(cards)
+        for i in range(len(cards), total):
+            card = copy.deepcopy(recorded[i % len(recorded)])
+            card['id'] = f"{card['id']}-copy{i}"
+            cards.append(card)
+
+    return cards
+
+
+class FakeAPI:
+    """The fake API's data and behaviour (shared by every request handler)."""
+
+    def __init__(self, cards, latency=0.05, jitter=0.02, failure_rate=0.0):
+        self.cards = {card['id']: card for card in cards}
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def search(self, query):
+        """Return the cards matching a `q` query."""
+
+        ids = re.findall(r'id:"([^"]+)"', query)
+        if ids:
+            return [self.cards[card_id] for card_id in ids if card_id in self.cards]
+
+        match = re.search(r'name:(?:"([^"]+)"|(\S+))', query)
+        if match:
+            name = (match.group(1) or match.group(2)).lower()
+            return [card for card in self.cards.values() if name in card['name'].lower()]
+
+        return list(self.cards.values())
+
+    def handle(self, path, params):
+        """Return (status, body) for a request."""
+
+        with self._lock:
+            self.requests += 1
+
+        time.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+
+        if random.random() < self.failure_rate:
+            return 503, {"error": {"message": "Service Unavailable", "code": 503}}
+
+        card_id = path.rstrip('/').rsplit('/cards', 1)[-1].lstrip('/')
+
+        if card_id:
+            card = self.cards.get(card_id)
+            if card is None:
+                return 404, {"error": {"message": "Not Found", "code": 404}}
+            return 200, {"data": card}
+
+        cards = self.search(params.get('q', ''))
+        page = int(params.get('page', 1))
+        page_size = min(int(params.get('pageSize', 250)), 250)
+        start = (page - 1) * page_size
+
+        return 200, {
+            "data": cards[start:start + page_size],
+            "page": page,
+            "pageSize": page_size,
+            "count": len(cards[start:start + page_size]),
+            "totalCount": len(cards),
+        }
+
+
+def make_server(api, host='127.0.0.1', port=0):
+    """Return an HTTP server for `api` (port 0 picks a free port)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive, like the real API
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+            status, body = api.handle(url.path, params)
+            payload = json.dumps(body).encode()
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(api, host='127.0.0.1', port=0):
+    """Start the fake API in a background thread. Returns (server, base url)."""
+
+    server = make_server(api, host, port)
+    threading.Thread(target=server.serve_forever, name='fake-api', daemon=True).start()
+
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}/v2/cards'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Pokemon TCG API.")
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--cards', type=int, default=None, help="clone the fixtures up to this many cards")
+    parser.add_argument('--latency', type=float, default=50, help="average response time in ms")
+    parser.add_argument('--jitter', type=float, default=20, help="+/- random variation of the response time in ms")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of requests answered with a 503")
+    args = parser.parse_args()
+
+    api = FakeAPI(load_fixtures(args.cards), args.latency / 1000, args.jitter / 1000, args.failure_rate)
+    server = make_server(api, port=args.port)
+
+    print(f"Fake Pokemon TCG API at http://127.0.0.1:{args.port}/v2/cards ({len(api.cards)} cards)")
+    server.serve_forever()
@@ -0,0 +1,275 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import requests
+
+from benchmark.fake_api import FakeAPI, load_fixtures, start_in_thread
+
+############################################################################################
+# LOAD TEST BENCHMARK
+#
+# Runs concurrent load against the app's main routes and reports throughput and
+# p50/p95/p99 latency for each, so results can be compared from run to run.
+#
+# The Pokemon TCG API is replaced by the local fake in fake_api.py and the app is
+# served in-process on a test database:
+#
+#   python -m benchmark.run --concurrency 20 --duration 10 --output results.json
+#   python -m benchmark.run --baseline results.json          # compare with an earlier run
+#
+# To benchmark a real server (e.g. gunicorn with gevent workers) instead, start
+# `python -m benchmark.fake_api`, point the server at it with POKEMON_TCG_API_URL,
+# and pass --app-url http://127.0.0.1:8000 (the benchmark user must exist, see --username).
+# The login form is protected by a CSRF token (LoginForm), which the benchmark reads from the
+# login page and posts back; the run stops with an error if the login is still refused.
+#
+# The most database queries any request of a route ran (read from its Server-Timing header)
+# is reported too. With --check-query-budgets, the run fails if a route goes over QUERY_BUDGETS.
+
+SEARCH_TERMS = ['pikachu', 'charizard', 'charmander', 'blastoise', 'mr. mime']
+FAVORITE_CARDS = ['swshp-SWSH020', 'base1-4', 'base1-2']
+
+
+def home(rng, card_ids):
+    return 'GET', '/'
+
+def search(rng, card_ids):
+    return 'GET', f'/cards?pokemon-search={rng.choice(SEARCH_TERMS)}&page={rng.randint(1, 3)}'
+
+def card_detail(rng, card_ids):
+    return 'GET', f'/cards/{rng.choice(card_ids)}'
+
+def user_profile(rng, card_ids):
+    return 'GET', '/user'
+
+def favorite_toggle(rng, card_ids):
+    return 'POST', f'/api/cards/{rng.choice(FAVORITE_CARDS)}/favorite'
+
+# most queries a single request may run, cache misses included
+# (the logged in user is only loaded when their session doesn't have it yet, see add_user_to_g)
+QUERY_BUDGETS = {
+    "home": 2,
+    "search": 4,
+    "card_detail": 3,
+    "user_profile": 3,
+    "favorite_toggle": 4,
+}
+
+# e.g. <input id="csrf_token" name="csrf_token" type="hidden" value="...">
+CSRF_TOKEN_PATTERN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+# e.g. 'db;dur=3.1;desc="2 calls"'
+DB_TIMING_PATTERN = re.compile(r'\bdb;dur=[\d.]+;desc="(\d+) calls?"')
+
+SCENARIOS = {
+    "home": home,
+    "search": search,
+    "card_detail": card_detail,
+    "user_profile": user_profile,
+    "favorite_toggle": favorite_toggle,
+}
+
+
+def percentile(sorted_values, percent):
+    """Return the `percent` percentile of `sorted_values` (nearest rank)."""
+
+    if not sorted_values:
+        return 0.0
+
+    index = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def query_count(response):
+    """Return the number of database queries the app reported for `response` in its Server-Timing header."""
+
+    match = DB_TIMING_PATTERN.search(response.headers.get('Server-Timing', ''))
+    return int(match.group(1)) if match else 0
+
+
+def login(app_url, username, password):
+    """Return a requests session logged in as the benchmark user. Exits if the login is refused."""
+
+    session = requests.Session()
+    data = {"username": username, "password": password}
+
+    # servers with CSRF protection on need the token from the login form (the in-process app has it off)
+    match = CSRF_TOKEN_PATTERN.search(session.get(f'{app_url}/login').text)
+    if match:
+        data["csrf_token"] = match.group(1)
+
+    response = session.post(f'{app_url}/login', data=data, allow_redirects=False)
+
+    # a successful login redirects to the homepage and sets the session cookie,
+    # a refused one (wrong password, bad CSRF token) shows the form again
+    if response.status_code != 302 or response.headers.get('Location', '').rstrip('/') not in ('', app_url.rstrip('/')) or 'session' not in session.cookies:
+        sys.exit(f"Logging in as {username!r} at {app_url} failed (HTTP {response.status_code}). "
+                 "Check that the user exists (see --username/--password) and that the login form's CSRF token is accepted.")
+
+    return session
+
+
+def run_scenario(name, app_url, card_ids, sessions, duration):
+    """Send requests for one scenario from every session until `duration` seconds have passed."""
+
+    scenario = SCENARIOS[name]
+    deadline = time.perf_counter() + duration
+    latencies = []
+    errors = [0]
+    max_queries = [0]
+    lock = threading.Lock()
+
+    def worker(index, session):
+        rng = random.Random(index)
+        results = []
+        failed = 0
+        most_queries = 0
+
+        while time.perf_counter() < deadline:
+            method, path = scenario(rng, card_ids)
+            start = time.perf_counter()
+
+            try:
+                response = session.request(method, f'{app_url}{path}', allow_redirects=False, timeout=30)
+                ok = response.status_code == 200
+                most_queries = max(most_queries, query_count(response))
+            except requests.RequestException:
+                ok = False
+
+            results.append(time.perf_counter() - start)
+            failed += not ok
+
+        with lock:
+            latencies.extend(results)
+            errors[0] += failed
+            max_queries[0] = max(max_queries[0], most_queries)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        list(pool.map(worker, range(len(sessions)), sessions))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "max_queries": max_queries[0],
+    }
+
+
+def start_app(database_url, api_url, username, password):
+    """Serve the app in-process on a fresh database. Returns its url."""
+
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['POKEMON_TCG_API_URL'] = api_url
+
+    from werkzeug.serving import make_server
+    from app import app
+    from models import db, User
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    db.drop_all()
+    db.create_all()
+    User.signup(username, password, f'{username}@example.com')
+    db.session.commit()
+    db.session.remove()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='app-server', daemon=True).start()
+
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def print_results(results, baseline=None):
+    """Print a table of results, with the change from `baseline` if there is one."""
+
+    print(f"\n{'route':<16} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8}")
+
+    for name, result in results.items():
+        print(f"{name:<16} {result['requests']:>9} {result['errors']:>7} {result['throughput']:>9.1f} "
+              f"{result['p50']:>9.1f} {result['p95']:>9.1f} {result['p99']:>9.1f} "
+              f"{result.get('max_queries', 0):>4}/{QUERY_BUDGETS[name]:<3}")
+
+        previous = (baseline or {}).get(name)
+        if previous:
+            change = lambda key: (result[key] - previous[key]) / previous[key] * 100 if previous[key] else 0
+            print(f"{'  vs baseline':<16} {'':>9} {'':>7} {change('throughput'):>+8.1f}% "
+                  f"{change('p50'):>+8.1f}% {change('p95'):>+8.1f}% {change('p99'):>+8.1f}%")
+
+
+def over_query_budget(results):
+    """Return the names of the routes which ran more queries in one request than QUERY_BUDGETS allows."""
+
+    return [name for name, result in results.items() if result['max_queries'] > QUERY_BUDGETS[name]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the app against a fake Pokemon TCG API.")
+    parser.add_argument('--routes', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=20, help="number of simultaneous clients")
+    parser.add_argument('--duration', type=float, default=10, help="seconds of load per route")
+    parser.add_argument('--cards', type=int, default=1000, help="size of the fake card catalog")
+    parser.add_argument('--latency', type=float, default=50, help="fake API response time in ms")
+    parser.add_argument('--jitter', type=float, default=20, help="fake API response time variation in ms")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of fake API requests that fail")
+    parser.add_argument('--database-url', default='postgresql:///pokemon-tcg-bench')
+    parser.add_argument('--app-url', help="benchmark an already running server instead of an in-process one")
+    parser.add_argument('--username', default='benchmark')
+    parser.add_argument('--password', default='benchmark-password')
+    parser.add_argument('--output', help="save the results to this JSON file")
+    parser.add_argument('--baseline', help="compare with results saved by an earlier run")
+    parser.add_argument('--check-query-budgets', action='store_true', help="fail if a route runs more queries than QUERY_BUDGETS")
+    args = parser.parse_args()
+
+    cards = load_fixtures(args.cards)
+    card_ids = [card['id'] for card in cards]
+
+    app_url = args.app_url
+    if not app_url:
+        api = FakeAPI(cards, args.latency / 1000, args.jitter / 1000, args.failure_rate)
+        fake_server, api_url = start_in_thread(api)
+        app_url = start_app(args.database_url, api_url, args.username, args.password)
+
+    sessions = [login(app_url, args.username, args.password) for _ in range(args.concurrency)]
+
+    # the favorite toggle needs its cards in the database, which happens on their first view
+    for card_id in FAVORITE_CARDS:
+        sessions[0].get(f'{app_url}/cards/{card_id}')
+        sessions[0].post(f'{app_url}/api/cards/{card_id}/favorite')
+
+    results = {}
+    for name in args.routes:
+        print(f"Running {name} for {args.duration}s with {args.concurrency} clients...")
+        results[name] = run_scenario(name, app_url, card_ids, sessions, args.duration)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+    over_budget = over_query_budget(results)
+    if over_budget:
+        print(f"\nOver their query budget: {', '.join(over_budget)}")
+        if args.check_query_budgets:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
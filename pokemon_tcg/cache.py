@@ -0,0 +1,292 @@
+from collections import OrderedDict
+import sys
+import threading
+import time
+
+############################################################################################
+# IN-PROCESS TTL + LRU CACHE
+#
+# Used to keep Pokemon TCG API responses in memory so popular searches and card
+# details don't make a full upstream round trip on every page view.
+#
+# Concurrent misses for the same key share a single load (see SingleFlight), and
+# errors like "card not found" can be cached for a short time too, so bad links
+# and bots can't multiply the number of upstream requests.
+
+MISSING = object()
+
+
+def estimate_size(value):
+    """Return a rough estimate (in bytes) of the memory used by `value`.
+
+    Walks dicts, lists, tuples and slotted objects (card records) recursively so a value is measured as a whole.
+    """
+
+    seen = set()
+    stack = [value]
+    size = 0
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(type(obj), '__slots__'):
+            stack.extend(getattr(obj, name) for name in type(obj).__slots__ if hasattr(obj, name))
+
+    return size
+
+
+class CachedError:
+    """An exception stored in the cache in place of a value. It is raised again on every hit."""
+
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time.
+
+    Callers asking for a key which is already being loaded wait for that call
+    and share its result (or its exception) instead of making their own.
+    """
+
+    class Call:
+        __slots__ = ('done', 'value', 'error')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.value = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Return `func()`, or the result of the call for `key` which is already in progress."""
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self.Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = func()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class CacheEntry:
+    """A single cached value with its expiry information."""
+
+    __slots__ = ('value', 'size', 'expires_at', 'stale_until', 'refreshing')
+
+    def __init__(self, value, size, expires_at, stale_until):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.refreshing = False
+
+
+class TTLCache:
+    """Thread-safe, bounded read-through cache.
+
+    - every entry has its own time to live (`ttl`)
+    - least recently used entries are evicted once `max_entries` or `max_bytes` is reached
+    - expired entries are still served for `stale_ttl` seconds while a background
+      thread refreshes them (stale-while-revalidate)
+    - concurrent misses for the same key are loaded once (single flight)
+    - hits, misses, stale hits and evictions are counted in `stats`
+    """
+
+    def __init__(self, name, max_entries=1024, max_bytes=32 * 1024 * 1024, ttl=300, stale_ttl=60,
+                 clock=time.monotonic):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._flights = SingleFlight()
+        self.current_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stale_hits": 0, "evictions": 0, "expirations": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not MISSING
+
+    def get(self, key, default=MISSING, count=True):
+        """Return the fresh value stored under `key`, or `default` if it is missing, expired or a cached error."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry.expires_at <= self.clock() or isinstance(entry.value, CachedError):
+                if count:
+                    self.stats["misses"] += 1
+                return default
+
+            self._entries.move_to_end(key)
+            if count:
+                self.stats["hits"] += 1
+            return entry.value
+
+    def set(self, key, value, ttl=None, stale_ttl=None):
+        """Store `value` under `key` and evict least recently used entries if over the limits."""
+
+        ttl = self.ttl if ttl is None else ttl
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        size = estimate_size(value)
+
+        # a value bigger than the whole cache would just evict everything else
+        if size > self.max_bytes:
+            return
+
+        now = self.clock()
+        entry = CacheEntry(value, size, now + ttl, now + ttl + stale_ttl)
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self.current_bytes += size
+            self._evict()
+
+    def delete(self, key):
+        """Remove `key` from the cache (if it is there)."""
+
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def get_or_load(self, key, loader, ttl=None, errors=(), error_ttl=60):
+        """Return the value for `key`, calling `loader()` to fill the cache on a miss.
+
+        An expired entry that is still inside its stale window is returned right away
+        and refreshed by a background thread, so the caller never waits on `loader`.
+        Concurrent misses for `key` share one `loader()` call.
+
+        `ttl` can also be a function of the loaded value (e.g. a shorter ttl for empty results).
+        Exceptions of the types in `errors` are cached for `error_ttl` seconds and raised
+        again on every hit, without calling `loader`.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            now = self.clock()
+
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._unwrap(entry.value)
+
+            if entry is not None and entry.stale_until > now:
+                self._entries.move_to_end(key)
+                self.stats["stale_hits"] += 1
+                if not entry.refreshing:
+                    entry.refreshing = True
+                    threading.Thread(target=self._refresh, args=(key, loader, ttl, entry), daemon=True).start()
+                return entry.value
+
+            self.stats["misses"] += 1
+
+        return self._unwrap(self._flights.do(key, lambda: self._load(key, loader, ttl, errors, error_ttl)))
+
+    def snapshot(self):
+        """Return the counters and current size of the cache (used for monitoring)."""
+
+        with self._lock:
+            return dict(self.stats, coalesced=self._flights.coalesced, entries=len(self._entries), bytes=self.current_bytes)
+
+    def _load(self, key, loader, ttl, errors, error_ttl):
+        # the previous load for this key may have finished just before this one started
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > self.clock():
+                return entry.value
+
+        try:
+            value = loader()
+        except errors as e:
+            self.set(key, CachedError(e), ttl=error_ttl, stale_ttl=0)
+            raise
+
+        self.set(key, value, ttl=ttl(value) if callable(ttl) else ttl)
+        return value
+
+    def _refresh(self, key, loader, ttl, entry):
+        """Reload a stale entry in the background. On failure the stale value is kept."""
+
+        try:
+            value = loader()
+            self.set(key, value, ttl=ttl(value) if callable(ttl) else ttl)
+        except Exception:
+            entry.refreshing = False
+
+    @staticmethod
+    def _unwrap(value):
+        if isinstance(value, CachedError):
+            raise value.error
+        return value
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.size
+
+    def _over_limit(self):
+        return len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes
+
+    def _evict(self):
+        if not self._over_limit():
+            return
+
+        now = self.clock()
+
+        # drop anything that is past its stale window first, then fall back to LRU order
+        for key in [key for key, entry in self._entries.items() if entry.stale_until <= now]:
+            self._remove(key)
+            self.stats["expirations"] += 1
+
+        while self._entries and self._over_limit():
+            key, entry = self._entries.popitem(last=False)
+            self.current_bytes -= entry.size
+            self.stats["evictions"] += 1
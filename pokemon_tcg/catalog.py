@@ -0,0 +1,364 @@
+from flask import has_app_context
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from models import db, Card, AppState
+from records import CardRecord
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import metrics
+import datetime
+import threading
+import time
+
+############################################################################################
+# LOCAL CARD CATALOG
+#
+# The `cards` table mirrors the Pokemon TCG API so searches and card details can be
+# served from Postgres. The API is only called when a card is missing locally, and
+# `sync.py` keeps the mirror up to date by pulling the whole catalog again (daily).
+#
+# TCGplayer prices change every day without the card's set changing, so a stored card is
+# also requested again in the background (see CardRefresher) when it is viewed and hasn't
+# been synced for REFRESH_AFTER, e.g. when sync.py isn't scheduled.
+
+SYNC_STATE_KEY = 'catalog_sync'
+SYNC_PAGE_SIZE = 250 # the largest page size the API allows
+REFRESH_AFTER = datetime.timedelta(days=1)
+
+# how many times a card is tried before it is dropped from the write buffer
+MAX_WRITE_ATTEMPTS = 5
+
+# how long flush(card_id) waits for another flush which is saving that card
+SAVE_WAIT_SECONDS = 30
+
+dropped_card_writes = metrics.registry.counter('pokemon_tcg_card_writes_dropped_total', "Cards dropped from the write buffer after failing to save MAX_WRITE_ATTEMPTS times.")
+
+
+class CatalogWriteError(Exception):
+    """Buffered cards couldn't be saved to the local catalog."""
+
+
+def get_card(card_id, refresh=None):
+    """Return the CardRecord for `card_id` from the local catalog, or None if it isn't stored.
+
+    If the stored card is older than REFRESH_AFTER, `refresh(card_id)` is called (it should
+    request the card again in the background) and the stored card is returned meanwhile.
+    """
+
+    row = db.session.query(Card.data, Card.synced_at).filter(Card.id == card_id, Card.data.isnot(None)).first()
+
+    if row is None:
+        return None
+
+    if refresh is not None and is_stale(row.synced_at):
+        refresh(card_id)
+
+    return CardRecord.from_api(row.data)
+
+
+def is_stale(synced_at):
+    """Return True if a card synced at `synced_at` (None: never synced from the API) should be requested again."""
+
+    return synced_at is None or datetime.datetime.now() - synced_at > REFRESH_AFTER
+
+
+def get_cards(card_ids):
+    """Return a dictionary of {card id: CardRecord} for the `card_ids` stored in the local catalog."""
+
+    if not card_ids:
+        return {}
+
+    rows = db.session.query(Card.id, Card.data).filter(Card.id.in_(card_ids), Card.data.isnot(None)).all()
+
+    return {row.id: CardRecord.from_api(row.data) for row in rows}
+
+
+def search_cards(name, page=1, page_size=24):
+    """Return one page of CardRecords for cards whose name contains `name`, and the total number of matches.
+
+    Returns None when the catalog has never been synced, since an incomplete
+    catalog can't tell "no results" apart from "not downloaded yet".
+    """
+
+    if not is_synced():
+        return None
+
+    query = db.session.query(Card.data).filter(Card.name.ilike(f'%{escape_like(name)}%'), Card.data.isnot(None))
+
+    total = query.count()
+    rows = query.order_by(Card.name, Card.id).limit(page_size).offset((page - 1) * page_size).all()
+
+    return [CardRecord.from_api(row.data) for row in rows], total
+
+
+def suggest_names(text, limit=10):
+    """Return up to `limit` distinct card names for the search box, best matches first.
+
+    Names starting with `text` come first (shortest first), then fuzzy matches from the
+    trigram index to catch typos like 'charzard'. Both use the `ix_cards_name_trgm` index.
+    """
+
+    names = [row.name for row in (db.session.query(Card.name)
+                                  .filter(Card.name.ilike(f'{escape_like(text)}%'))
+                                  .group_by(Card.name)
+                                  .order_by(func.length(Card.name), Card.name)
+                                  .limit(limit))]
+
+    if len(names) < limit:
+        similarity = func.similarity(Card.name, text)
+        fuzzy = (db.session.query(Card.name)
+                 .filter(Card.name.op('%')(text), Card.name.notin_(names))
+                 .group_by(Card.name)
+                 .order_by(func.max(similarity).desc(), Card.name)
+                 .limit(limit - len(names)))
+
+        names.extend(row.name for row in fuzzy)
+
+    return names
+
+
+def save_cards(cards):
+    """Insert or update the API payloads in `cards` with a single statement."""
+
+    if not cards:
+        return
+
+    # a card can only be upserted once per statement
+    values = list({card['id']: Card.values_from_api(card) for card in cards}.values())
+
+    stmt = insert(Card).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Card.id],
+        set_={column: stmt.excluded[column] for column in values[0] if column != 'id'},
+    )
+
+    db.session.execute(stmt)
+    db.session.commit()
+
+
+class CardWriteBuffer:
+    """Write-behind buffer for cards requested from the API.
+
+    Card detail pages add the card they fetched here instead of committing it themselves.
+    A background thread saves the buffered cards every `flush_seconds` (or as soon as
+    `max_cards` are waiting) with one multi-row upsert, so concurrent workers can't
+    collide on the same card and a page view never waits on a database commit.
+
+    Cards being saved stay visible (`get()`, `flush(card_id)`) until their commit is done.
+    Failed saves are logged and retried on the next flush. A card which still can't be
+    saved after `max_attempts` flushes is dropped (it is requested again when it is viewed).
+    """
+
+    def __init__(self, app=None, flush_seconds=2, max_cards=100, max_attempts=MAX_WRITE_ATTEMPTS):
+        self.app = app
+        self.flush_seconds = flush_seconds
+        self.max_cards = max_cards
+        self.max_attempts = max_attempts
+
+        self._pending = {}
+        self._in_flight = {} # cards taken by a flush whose commit isn't done yet
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._saved = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        """Save the cards to `app`'s database."""
+
+        self.app = app
+
+    def add(self, card):
+        """Queue an API payload to be saved to the local catalog."""
+
+        with self._lock:
+            self._pending[card['id']] = card
+            full = len(self._pending) >= self.max_cards
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='card-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+        if full:
+            self._wakeup.set()
+
+    def get(self, card_id):
+        """Return the payload for `card_id` if it is waiting to be saved (or being saved)."""
+
+        with self._lock:
+            card = self._pending.get(card_id)
+            return card if card is not None else self._in_flight.get(card_id)
+
+    def flush(self, card_id=None):
+        """Save the buffered cards now.
+
+        With `card_id`, only flush if that card is still waiting, and wait for the flush which
+        is already saving it (e.g. before it is favorited, since the favorites table needs the
+        card to exist). Raises CatalogWriteError if the cards can't be saved.
+        """
+
+        with self._lock:
+            if card_id is not None and card_id not in self._pending:
+                # if that flush fails, the card is back in `_pending` and saved below
+                self._saved.wait_for(lambda: card_id not in self._in_flight, timeout=SAVE_WAIT_SECONDS)
+
+                if card_id not in self._pending:
+                    return
+
+            cards, self._pending = list(self._pending.values()), {}
+            self._in_flight.update((card['id'], card) for card in cards)
+
+        if not cards:
+            return
+
+        try:
+            if has_app_context():
+                save_cards(cards)
+            else:
+                with self.app.app_context():
+                    save_cards(cards)
+        except Exception as e:
+            self._retry_later(cards)
+            raise CatalogWriteError(f"Saving {len(cards)} cards failed: {e}") from e
+
+        with self._lock:
+            for card in cards:
+                self._attempts.pop(card['id'], None)
+            self._land(cards)
+
+    def _land(self, cards):
+        # called with the lock held, once the flush which took `cards` is over
+        for card in cards:
+            # a later flush may be saving a newer payload for the same card
+            if self._in_flight.get(card['id']) is card:
+                del self._in_flight[card['id']]
+
+        self._saved.notify_all()
+
+    def _retry_later(self, cards):
+        """Put the cards of a failed flush back (newer payloads win), dropping those out of attempts."""
+
+        dropped = []
+
+        with self._lock:
+            for card in cards:
+                attempts = self._attempts.get(card['id'], 0) + 1
+
+                if attempts >= self.max_attempts:
+                    self._attempts.pop(card['id'], None)
+                    dropped.append(card['id'])
+                else:
+                    self._attempts[card['id']] = attempts
+                    self._pending.setdefault(card['id'], card)
+
+            self._land(cards)
+
+        self.app.logger.exception("Saving %d cards to the catalog failed", len(cards))
+
+        if dropped:
+            dropped_card_writes.inc(len(dropped))
+            self.app.logger.error("Dropped %d cards after %d failed saves: %s", len(dropped), self.max_attempts, ', '.join(dropped))
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.flush_seconds)
+
+
+class CardRefresher:
+    """Requests stored cards from the API again in the background.
+
+    `refresh(card_id)` returns right away. A card is only requested once at a time, and
+    when `max_pending` cards are already waiting new ones are dropped (they are refreshed
+    the next time they are viewed). The payload is handed to `writer` (a CardWriteBuffer)
+    and the new CardRecord to `on_refresh`, e.g. to update a cache.
+    """
+
+    def __init__(self, fetch, writer, on_refresh=None, max_pending=100):
+        self.fetch = fetch
+        self.writer = writer
+        self.on_refresh = on_refresh
+        self.max_pending = max_pending
+
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def refresh(self, card_id):
+        with self._lock:
+            if card_id in self._pending or len(self._pending) >= self.max_pending:
+                return
+            self._pending.add(card_id)
+
+            # one thread, so refreshes never add more than one request at a time upstream
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='card-refresher')
+
+        self._pool.submit(self._refresh, card_id)
+
+    def _refresh(self, card_id):
+        try:
+            data = self.fetch(card_id)
+            self.writer.add(data)
+
+            if self.on_refresh is not None:
+                self.on_refresh(CardRecord.from_api(data))
+        except Exception:
+            pass # the stored card is still served, the next view tries again
+        finally:
+            with self._lock:
+                self._pending.discard(card_id)
+
+
+def is_synced():
+    """Return True if the full catalog has been downloaded at least once."""
+
+    return db.session.query(AppState.key).filter(AppState.key == SYNC_STATE_KEY).scalar() is not None
+
+
+def sync_catalog(api):
+    """Pull the whole catalog from the API into the local catalog. Returns the number of cards saved.
+
+    Every card is requested on each run: a set's updatedAt doesn't change when its cards'
+    TCGplayer prices do, so it can't tell which cards changed since the last run.
+    """
+
+    state = AppState.query.get(SYNC_STATE_KEY)
+    started_at = datetime.datetime.utcnow()
+
+    params = {"pageSize": SYNC_PAGE_SIZE, "orderBy": "id"}
+
+    page = 1
+    saved = 0
+
+    while True:
+        data = api.get(params=dict(params, page=page))
+
+        save_cards(data['data'])
+        saved += len(data['data'])
+
+        if not data['data'] or page * SYNC_PAGE_SIZE >= data['totalCount']:
+            break
+        page += 1
+
+    # only record the sync once every page has been saved, so a failed run is retried in full
+    value = {"last_synced_at": started_at.strftime('%Y/%m/%d'), "cards": saved}
+    if state:
+        state.value = value
+    else:
+        db.session.add(AppState(key=SYNC_STATE_KEY, value=value))
+    db.session.commit()
+
+    return saved
+
+
+def escape_like(value):
+    """Escape the LIKE wildcards in `value` so they are matched literally."""
+
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
@@ -0,0 +1,67 @@
+import os
+
+############################################################################################
+# APP SETTINGS
+#
+# create_app() (see app.py) takes one of these, or its name in CONFIGS.
+# Without one it uses APP_CONFIG, or 'development' when FLASK_ENV=development.
+# Production carries no development-only extensions (the debug toolbar is never imported).
+
+
+def database_uri():
+    """Return DATABASE_URL in the form SQLAlchemy expects (Heroku still hands out postgres:// urls)."""
+
+    uri = os.environ.get('DATABASE_URL', 'postgresql:///pokemon_tcg')
+    if uri.startswith("postgres://"):
+        uri = uri.replace("postgres://", "postgresql://", 1)
+
+    return uri
+
+
+class Config:
+    """Settings shared by every environment."""
+
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+
+    # development-only extensions
+    DEBUG_TB_ENABLED = False
+
+    # log N+1 query patterns (see queries.py)
+    QUERY_WARNINGS = False
+
+    # /metrics needs `Authorization: Bearer <METRICS_TOKEN>`, unless it is public (see metrics.py)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_PUBLIC = False
+
+
+class ProductionConfig(Config):
+    pass
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    DEBUG_TB_ENABLED = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+    QUERY_WARNINGS = True
+    METRICS_PUBLIC = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///pokemon-tcg-test'
+
+
+CONFIGS = {
+    'production': ProductionConfig,
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+}
+
+
+def default_config():
+    """Return the name of the config to use when create_app() isn't given one."""
+
+    return os.environ.get('APP_CONFIG') or ('development' if os.environ.get('FLASK_ENV') == 'development' else 'production')
@@ -0,0 +1,84 @@
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import NullPool, QueuePool
+import metrics
+import os
+import time
+
+############################################################################################
+# DATABASE CONNECTION POOL
+#
+# Every gunicorn worker has its own pool, and they all share Postgres' connection limit
+# (20 on Heroku's smallest plans). The pool used to be SQLAlchemy's default (5 + 10 overflow)
+# whatever the number of workers, which is where `QueuePool limit of size 5 overflow 10
+# reached` came from. It is now sized from the worker settings:
+#
+#   connections per worker = (DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS) / WEB_CONCURRENCY
+#
+# and split between the pool and its overflow by how many requests a worker runs at once.
+# With DB_POOL_MODE=pgbouncer, connections are opened per checkout (NullPool) and pgbouncer
+# does the pooling. Checkout waits, timeouts and pool usage are reported at /metrics.
+
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_RESERVED_CONNECTIONS = 2 # left over for sync.py, migrations and psql
+BACKGROUND_CONNECTIONS = 2 # the card writer and the featured cards refresh (see catalog.py, featured.py)
+DEFAULT_POOL_TIMEOUT = 10 # fail before gunicorn's 30 second worker timeout
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool which records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            metrics.db_pool_timeouts.inc()
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            metrics.db_pool_wait_seconds.observe(seconds)
+            metrics.record('pool', seconds)
+
+
+def worker_concurrency(environ):
+    """Return the number of requests a gunicorn worker handles at the same time."""
+
+    worker_class = environ.get('GUNICORN_WORKER_CLASS', 'sync')
+
+    if worker_class == 'gevent':
+        return int(environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+    if worker_class == 'gthread' or int(environ.get('GUNICORN_THREADS', 1)) > 1:
+        return int(environ.get('GUNICORN_THREADS', 1))
+    return 1
+
+
+def pool_size(workers, concurrency, max_connections, reserved=DEFAULT_RESERVED_CONNECTIONS):
+    """Return (pool_size, max_overflow) for one worker's share of `max_connections`."""
+
+    per_worker = max((max_connections - reserved) // max(workers, 1), 1)
+    size = min(concurrency + BACKGROUND_CONNECTIONS, per_worker)
+
+    return size, per_worker - size
+
+
+def engine_options(environ=os.environ):
+    """Return the SQLALCHEMY_ENGINE_OPTIONS for the pool settings in `environ`."""
+
+    if environ.get('DB_POOL_MODE', 'queue') == 'pgbouncer':
+        # pgbouncer keeps the server connections; check each one is alive before it is used
+        return {"poolclass": NullPool, "pool_pre_ping": True}
+
+    size, overflow = pool_size(
+        int(environ.get('WEB_CONCURRENCY', 1)),
+        worker_concurrency(environ),
+        int(environ.get('DB_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)),
+        int(environ.get('DB_RESERVED_CONNECTIONS', DEFAULT_RESERVED_CONNECTIONS)),
+    )
+
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": int(environ.get('DB_POOL_SIZE', size)),
+        "max_overflow": int(environ.get('DB_MAX_OVERFLOW', overflow)),
+        "pool_timeout": int(environ.get('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)),
+        "pool_pre_ping": environ.get('DB_POOL_PRE_PING', '') == '1',
+    }
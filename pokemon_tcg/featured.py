@@ -0,0 +1,115 @@
+from models import db, AppState
+import datetime
+import threading
+import time
+
+############################################################################################
+# HOMEPAGE FEATURED CARDS
+#
+# The homepage used to query the API on every visit. Instead, a snapshot of the featured
+# cards is built once, saved in the `app_state` table (so every worker shares it) and
+# refreshed by a background thread. Rendering the homepage only reads it from memory.
+
+FEATURED_STATE_KEY = 'featured_cards'
+FEATURED_QUERY = 'name:m' # query cards with 'm' in their name to display on homepage
+FEATURED_POSITIONS = (1, 4, 5, 9) # positions in the search results of the cards which are displayed
+REFRESH_SECONDS = 6 * 60 * 60
+RETRY_SECONDS = 60 # how soon to try again when there is no snapshot at all
+
+
+class FeaturedCards:
+    """Snapshot of the cards shown on the homepage, refreshed in the background."""
+
+    def __init__(self, api, app=None, refresh_seconds=REFRESH_SECONDS):
+        self.app = app
+        self.api = api
+        self.refresh_seconds = refresh_seconds
+
+        self.cards = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        """Use `app`'s database for the snapshot."""
+
+        self.app = app
+
+    def get(self):
+        """Return the featured cards. Only the very first call can touch the database or the API."""
+
+        if self.cards is None:
+            with self._lock:
+                if self.cards is None:
+                    self.cards = self.load() or self.refresh() or []
+                self.start()
+
+        return self.cards
+
+    def start(self):
+        """Start the background refresh thread (once per process)."""
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='featured-cards', daemon=True)
+            self._thread.start()
+
+    def load(self):
+        """Return the saved snapshot, or None if there isn't one."""
+
+        state = AppState.query.get(FEATURED_STATE_KEY)
+
+        return state.value if state else None
+
+    def refresh(self):
+        """Build a new snapshot from the API and save it. Returns the cards (None if the request failed)."""
+
+        try:
+            cards = self.build()
+        except Exception:
+            return None
+
+        # keep the current snapshot rather than replacing it with an empty one
+        if not cards:
+            return None
+
+        state = AppState.query.get(FEATURED_STATE_KEY)
+        if state:
+            state.value = cards
+        else:
+            db.session.add(AppState(key=FEATURED_STATE_KEY, value=cards))
+        db.session.commit()
+
+        self.cards = cards
+        return cards
+
+    def build(self):
+        """Request the featured cards from the API, keeping only what the homepage needs."""
+
+        data = self.api.get(params={"q": FEATURED_QUERY, "pageSize": max(FEATURED_POSITIONS) + 1})['data']
+
+        # if fewer cards come back, show the ones we have instead of failing
+        return [
+            {"id": card['id'], "name": card['name'], "images": {"small": card['images']['small']}}
+            for position, card in enumerate(data) if position in FEATURED_POSITIONS
+        ]
+
+    def _run(self):
+        """Refresh the snapshot on a schedule.
+
+        With several workers running, only the first one to wake up after the snapshot
+        goes stale requests it from the API; the others pick up the saved copy.
+        """
+
+        while True:
+            time.sleep(self.refresh_seconds if self.cards else RETRY_SECONDS)
+
+            with self.app.app_context():
+                try:
+                    state = AppState.query.get(FEATURED_STATE_KEY)
+                    age = datetime.datetime.now() - state.updated_at if state else None
+
+                    if age is not None and age.total_seconds() < self.refresh_seconds:
+                        self.cards = state.value
+                    else:
+                        self.refresh()
+                except Exception:
+                    db.session.rollback() # try again on the next run
@@ -0,0 +1,49 @@
+import multiprocessing
+import os
+
+############################################################################################
+# GUNICORN SETTINGS (read automatically by `gunicorn "app:create_app()"` in the Procfile)
+#
+# Most of a request's time is spent waiting on the Pokemon TCG API. With the default sync
+# worker, each worker process handles one request at a time and sits idle during that wait.
+# The gevent worker runs every request in a greenlet instead: network calls (requests, and
+# psycopg2 once patched below) yield to other requests, so one process can keep hundreds of
+# upstream calls in flight. Set GUNICORN_WORKER_CLASS=sync to go back to the old behaviour.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+
+# requests each gevent worker will handle at the same time
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+# build the app once in the master process and fork the workers from it: workers start faster
+# and share the memory of everything imported at startup. Nothing opens a database connection
+# or starts a thread while the app is built, so nothing is shared between the workers by accident.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# the app (and requests/ssl) is imported before the workers patch the standard library,
+# so patch it here first, before anything else is imported
+if worker_class == 'gevent' and preload_app:
+    from gevent import monkey
+    monkey.patch_all()
+
+# threads per worker, only used by the gthread worker
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+
+# the app sizes its database pool from these (see db_pool.py), so pass on the defaults chosen above
+os.environ['GUNICORN_WORKER_CLASS'] = worker_class
+os.environ['WEB_CONCURRENCY'] = str(workers)
+os.environ['GUNICORN_WORKER_CONNECTIONS'] = str(worker_connections)
+os.environ['GUNICORN_THREADS'] = str(threads)
+
+
+def post_fork(server, worker):
+    """Make psycopg2 cooperative so database queries don't block the other greenlets."""
+
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
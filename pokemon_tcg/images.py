@@ -0,0 +1,203 @@
+from flask import abort, redirect, request, send_file
+from PIL import Image
+from cache import SingleFlight
+import io
+import os
+import re
+import tempfile
+import threading
+import requests
+
+############################################################################################
+# CARD IMAGE PROXY
+#
+# Card images used to be hotlinked from the Pokemon TCG API's image CDN. They are now served
+# from /images/<set id>/<file>?size=..., backed by a size-bounded cache on disk:
+# - 'thumb' is a WebP made once (from the large image) for the search/favorites grids
+# - 'small' / 'large' are the original images
+# Image urls never change, so responses can be cached by browsers forever (immutable).
+# Concurrent requests for an image which isn't cached yet share one download.
+
+IMAGE_HOST = 'https://images.pokemontcg.io'
+IMAGE_URL_PATTERN = re.compile(r'^https://images\.pokemontcg\.io/([\w.-]+)/([\w.-]+\.png)$')
+NAME_PATTERN = re.compile(r'^\w[\w.-]*$') # no '..' or hidden files
+
+# the grids show cards up to 235px wide, scaled by 1.1 on hover: twice that stays sharp on HiDPI screens
+THUMBNAIL_WIDTH = 470
+THUMBNAIL_QUALITY = 80
+SIZES = ('thumb', 'small', 'large')
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+def card_image(url, size='thumb'):
+    """Jinja filter: turn an API image url into the url of our image proxy.
+
+    'https://images.pokemontcg.io/swsh4/44.png' -> '/images/swsh4/44.png?size=thumb&w=470'
+    Urls from anywhere else are returned unchanged. Thumbnail urls include their width, so
+    browsers holding a thumbnail of another width (cached as immutable) request the new one.
+    """
+
+    match = IMAGE_URL_PATTERN.match(url or '')
+    if not match:
+        return url
+
+    url = f'/images/{match.group(1)}/{match.group(2)}?size={size}'
+
+    return f'{url}&w={THUMBNAIL_WIDTH}' if size == 'thumb' else url
+
+
+class ImageCache:
+    """Card images stored on disk, with the least recently used ones removed over `max_bytes`."""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, timeout=(3.05, 10)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._total_bytes = None
+
+    def path(self, set_id, filename, size):
+        extension = 'webp' if size == 'thumb' else 'png'
+        name = os.path.splitext(filename)[0]
+        return os.path.join(self.directory, set_id, f'{name}.{size}.{extension}')
+
+    def get(self, set_id, filename, size):
+        """Return the path of the cached image, downloading (and resizing) it on a miss."""
+
+        path = self.path(set_id, filename, size)
+
+        if os.path.exists(path):
+            os.utime(path) # marks it as recently used
+            return path
+
+        return self._flights.do(path, lambda: self._fetch(set_id, filename, size, path))
+
+    def _fetch(self, set_id, filename, size, path):
+        # another request may have saved it just before this one started
+        if os.path.exists(path):
+            return path
+
+        content = self.download(set_id, filename)
+        if size == 'thumb':
+            content = make_thumbnail(content)
+
+        self.save(path, content)
+        return path
+
+    def download(self, set_id, filename):
+        """Return the original image from the API's image CDN."""
+
+        response = self.session.get(f'{IMAGE_HOST}/{set_id}/{filename}', timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def save(self, path, content):
+        """Write the image atomically, then remove old images if the cache is over its size limit."""
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+            f.write(content)
+        os.replace(f.name, path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size in self._files())
+            else:
+                self._total_bytes += len(content)
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def _evict(self):
+        # remove least recently used images until the cache is down to 90% of its limit
+        files = sorted(self._files(), key=lambda file: file[1])
+        target = self.max_bytes * 0.9
+
+        for path, _, size in files:
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
+
+
+def make_thumbnail(content):
+    """Return a WebP version of a PNG image, at most THUMBNAIL_WIDTH wide (narrower images aren't scaled up)."""
+
+    image = Image.open(io.BytesIO(content))
+    width = min(THUMBNAIL_WIDTH, image.width)
+    height = round(image.height * width / image.width)
+
+    thumbnail = image.convert('RGBA').resize((width, height), Image.LANCZOS)
+
+    output = io.BytesIO()
+    thumbnail.save(output, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+    return output.getvalue()
+
+
+def init_app(app):
+    """Register the image proxy route and the `card_image` template filter on `app`."""
+
+    image_cache = ImageCache(
+        os.environ.get('IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'pokemon_tcg_images')),
+        max_bytes=int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024)),
+    )
+
+    app.jinja_env.filters['card_image'] = card_image
+
+    @app.route('/images/<set_id>/<filename>')
+    def card_image_proxy(set_id, filename):
+        """Serve a card image (or its thumbnail) from the local image cache"""
+
+        size = request.args.get('size', 'thumb')
+
+        if size not in SIZES or not NAME_PATTERN.match(set_id) or not NAME_PATTERN.match(filename) or not filename.endswith('.png'):
+            abort(404)
+
+        # the large image on the API's CDN is <number>_hires.png (thumbnails are made from it too)
+        source = filename
+        if size in ('large', 'thumb') and not filename.endswith('_hires.png'):
+            source = filename[:-len('.png')] + '_hires.png'
+
+        # the image the page asked for, served straight from the CDN if it can't be cached
+        fallback = f"{IMAGE_HOST}/{set_id}/{source if size == 'large' else filename}"
+
+        try:
+            path = image_cache.get(set_id, source, size)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                abort(404)
+            return redirect(fallback)
+
+        except (requests.RequestException, OSError):
+            # serve the page's image straight from the CDN rather than not at all
+            return redirect(fallback)
+
+        try:
+            response = send_file(path, max_age=ONE_YEAR, conditional=True)
+        except FileNotFoundError:
+            # removed by the cache's eviction since it was looked up
+            return redirect(fallback)
+
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    app.extensions['image_cache'] = image_cache
@@ -0,0 +1,231 @@
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import time
+
+from models import db, Card, AppState
+
+############################################################################################
+# BULK CATALOG LOADER
+#
+# Fills the `cards` table from a local copy of the Pokemon TCG data dump
+# (https://github.com/PokemonTCG/pokemon-tcg-data), instead of waiting for each card to be
+# viewed once:
+#
+#   python load_catalog.py path/to/pokemon-tcg-data
+#
+# The dump has one JSON array per set (cards/en/<set id>.json) and the sets in sets/en.json.
+# Each file is read in small chunks and parsed one card at a time, cards are written with
+# Postgres COPY into a temporary table and upserted from there in batches.
+#
+# Each set file is recorded in `app_state` once it is loaded, so an interrupted run picks up
+# where it stopped. Running it again is safe: cards are upserted, and data the dump doesn't
+# have (e.g. prices from the API) is kept.
+#
+# The dump has no TCGplayer prices. Cards it adds are stored without a `synced_at`, so each
+# one is requested from the API in the background the first time it is viewed (see
+# catalog.CardRefresher), and the catalog isn't marked as synced: searches keep using the
+# API until sync.py has pulled the catalog, prices included.
+
+LOAD_STATE_KEY = 'catalog_load'
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+COLUMNS = ('id', 'name', 'supertype', 'hp', 'types', 'image_small', 'image_large',
+           'set_id', 'updated_at', 'data', 'synced_at')
+
+
+def iter_json_array(f, chunk_size=CHUNK_SIZE):
+    """Yield the items of the JSON array in the text file `f` one at a time.
+
+    Only `chunk_size` characters (plus the item being parsed) are held in memory.
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    started = False
+
+    while True:
+        # skip whitespace and the commas between items, reading more when the buffer runs out
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n' + (',' if started else ''):
+            pos += 1
+
+        if pos == len(buffer):
+            buffer, pos = f.read(chunk_size), 0
+            if not buffer:
+                raise ValueError("Unexpected end of file, expected a JSON array.")
+            continue
+
+        if not started:
+            if buffer[pos] != '[':
+                raise ValueError("Expected a JSON array.")
+            started = True
+            pos += 1
+            continue
+
+        if buffer[pos] == ']':
+            return
+
+        try:
+            item, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # the item continues in the next chunk
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        yield item
+
+
+def find_dump_files(path):
+    """Return (card files, sets file) for a dump directory (the sets file may be None)."""
+
+    cards_dir = os.path.join(path, 'cards', 'en')
+    if not os.path.isdir(cards_dir):
+        cards_dir = path # a directory of set files on its own
+
+    sets_file = os.path.join(path, 'sets', 'en.json')
+
+    return sorted(glob.glob(os.path.join(cards_dir, '*.json'))), sets_file if os.path.exists(sets_file) else None
+
+
+def load_sets(sets_file):
+    """Return a dictionary of {set id: set} from the dump's sets file."""
+
+    if sets_file is None:
+        return {}
+
+    with open(sets_file, encoding='utf-8') as f:
+        return {card_set['id']: card_set for card_set in iter_json_array(f)}
+
+
+def array_literal(values):
+    """Format a list of strings as a Postgres array literal for COPY."""
+
+    if values is None:
+        return None
+
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"') for value in values)
+    return '{' + ','.join(f'"{value}"' for value in escaped) + '}'
+
+
+def copy_rows(cards):
+    """Return the CSV text COPY reads for `cards` (API payloads)."""
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    for card in cards:
+        values = Card.values_from_api(card)
+        values['types'] = array_literal(values['types'])
+        values['data'] = json.dumps(values['data'], ensure_ascii=False)
+        values['synced_at'] = None # not synced from the API: the dump has no prices
+        writer.writerow([values[column] for column in COLUMNS])
+
+    output.seek(0)
+    return output
+
+
+def copy_cards(cards):
+    """Upsert `cards` through a temporary table filled with COPY (part of the current transaction).
+
+    Keys the new payload doesn't have (e.g. 'tcgplayer' prices for a card already requested from the API)
+    are kept, and so is the card's `synced_at`.
+    """
+
+    # a card can only be upserted once per statement
+    cards = list({card['id']: card for card in cards}.values())
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute("CREATE TEMPORARY TABLE IF NOT EXISTS cards_staging (LIKE cards INCLUDING DEFAULTS)")
+    cursor.copy_expert(f"COPY cards_staging ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", copy_rows(cards))
+
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in COLUMNS if column not in ('id', 'data', 'synced_at'))
+    cursor.execute(f"""
+        INSERT INTO cards ({', '.join(COLUMNS)})
+        SELECT {', '.join(COLUMNS)} FROM cards_staging
+        ON CONFLICT (id) DO UPDATE SET {updates}, data = COALESCE(cards.data, '{{}}'::jsonb) || EXCLUDED.data
+    """)
+    cursor.execute("TRUNCATE cards_staging")
+
+
+def load_catalog(path, batch_size=BATCH_SIZE, restart=False, log=print):
+    """Load every card in the dump at `path` into the `cards` table. Returns the number of cards loaded.
+
+    Set files already loaded by an earlier run are skipped unless `restart` is True.
+    The dump has no prices: cards are loaded without them, and searches only use the
+    catalog once sync.py has run.
+    """
+
+    card_files, sets_file = find_dump_files(path)
+    sets = load_sets(sets_file)
+
+    state = AppState.query.get(LOAD_STATE_KEY)
+    if state is None:
+        state = AppState(key=LOAD_STATE_KEY, value={"files": []})
+        db.session.add(state)
+
+    done = set() if restart else set(state.value['files'])
+    loaded = 0
+    start = time.perf_counter()
+
+    for card_file in card_files:
+        name = os.path.basename(card_file)
+        if name in done:
+            continue
+
+        # the dump's card files don't include their set, the API's payloads do
+        set_id = os.path.splitext(name)[0]
+        card_set = sets.get(set_id, {"id": set_id})
+        batch = []
+        count = 0
+
+        with open(card_file, encoding='utf-8') as f:
+            for card in iter_json_array(f):
+                if 'set' not in card:
+                    card['set'] = card_set
+                batch.append(card)
+
+                if len(batch) >= batch_size:
+                    copy_cards(batch)
+                    db.session.commit()
+                    count += len(batch)
+                    batch = []
+
+        if batch:
+            copy_cards(batch)
+            count += len(batch)
+
+        # recorded in the same transaction as the file's last batch
+        done.add(name)
+        state.value = {"files": sorted(done)}
+        db.session.commit()
+
+        loaded += count
+        log(f"{name}: {count} cards")
+
+    log(f"Loaded {loaded} cards in {time.perf_counter() - start:.1f}s.")
+    return loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the card catalog from a Pokemon TCG data dump.")
+    parser.add_argument('path', help="the pokemon-tcg-data directory (or a directory of per-set card files)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="cards per COPY/upsert")
+    parser.add_argument('--restart', action='store_true', help="load every file again, even if an earlier run loaded it")
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        load_catalog(args.path, batch_size=args.batch_size, restart=args.restart)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+from flask import abort, g, request, has_request_context, before_render_template, template_rendered, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from functools import wraps
+import hmac
+import threading
+import time
+
+############################################################################################
+# REQUEST TIMING + METRICS
+#
+# Times the parts of a request that can make a page slow (Pokemon TCG API calls, database
+# queries, bcrypt, template rendering) and reports them two ways:
+# - a `Server-Timing` header on every response (shows up in the browser's network tab)
+# - Prometheus-style metrics at /metrics (per-route latency histograms, API call counts, query counts)
+#
+# Metrics are kept per process, so with several gunicorn workers each one reports its own numbers.
+# They describe the site's traffic and internals, so /metrics is only served with the
+# METRICS_TOKEN (`Authorization: Bearer <token>`, e.g. Prometheus' `bearer_token`), or to
+# anyone when METRICS_PUBLIC is on (development). Otherwise it is a 404.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Counter:
+    """A number that only goes up, e.g. the number of API calls."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{format_labels(key)} {value}' for key, value in sorted(self.values.items()))
+        return lines
+
+
+class Histogram:
+    """Counts of observed values (e.g. response times) in buckets, plus their sum and count."""
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self.values.setdefault(key, [0] * len(self.buckets) + [0, 0.0])
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+
+        for key, counts in sorted(self.values.items()):
+            for bucket, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{format_labels(key + (("le", bucket),))} {count}')
+            lines.append(f'{self.name}_bucket{format_labels(key + (("le", "+Inf"),))} {counts[-2]}')
+            lines.append(f'{self.name}_count{format_labels(key)} {counts[-2]}')
+            lines.append(f'{self.name}_sum{format_labels(key)} {counts[-1]:.6f}')
+
+        return lines
+
+
+class Registry:
+    """All of the app's metrics, plus collectors which report values computed on demand."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, description):
+        metric = Counter(name, description)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, description, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Register a function returning a list of metric lines, called on every /metrics request."""
+
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_seconds = registry.histogram('pokemon_tcg_request_seconds', "Time spent handling requests, by route.")
+step_seconds = registry.histogram('pokemon_tcg_step_seconds', "Time spent in each step of a request (cards, upstream, db, auth, render).")
+upstream_calls = registry.counter('pokemon_tcg_upstream_calls_total', "Requests made to the Pokemon TCG API.")
+db_queries = registry.counter('pokemon_tcg_db_queries_total', "Database queries, by route.")
+db_pool_wait_seconds = registry.histogram('pokemon_tcg_db_pool_wait_seconds', "Time spent waiting for a database connection from the pool.",
+                                          buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+db_pool_timeouts = registry.counter('pokemon_tcg_db_pool_timeouts_total', "Requests which gave up waiting for a database connection.")
+
+
+def record(step, seconds):
+    """Add `seconds` spent in `step` to the metrics and to the current request's Server-Timing."""
+
+    step_seconds.observe(seconds, step=step)
+
+    if has_request_context():
+        timings = g.setdefault('timings', {})
+        total, count = timings.get(step, (0.0, 0))
+        timings[step] = (total + seconds, count + 1)
+
+
+def timed(step):
+    """Decorator: record the time spent in the decorated function as `step`."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(step, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def route_name():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def server_timing_header(timings, total):
+    """Return the Server-Timing header value, e.g. 'db;dur=3.1;desc="2 calls", total;dur=25.0'."""
+
+    parts = [f'{step};dur={seconds * 1000:.1f};desc="{count} call{"s" if count != 1 else ""}"'
+             for step, (seconds, count) in timings.items()]
+    parts.append(f'total;dur={total * 1000:.1f}')
+
+    return ', '.join(parts)
+
+
+############################################################################################
+# HOOKS
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record('db', time.perf_counter() - conn.info['query_start'].pop())
+    db_queries.inc(route=route_name() if has_request_context() else 'background')
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('render_start', []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    record('render', time.perf_counter() - g.render_start.pop())
+
+
+def _record_upstream_response(response, *args, **kwargs):
+    upstream_calls.inc(status=response.status_code)
+    record('upstream', response.elapsed.total_seconds())
+
+
+def instrument_session(session):
+    """Count and time every response received by a requests session (the API client's)."""
+
+    session.hooks['response'].append(_record_upstream_response)
+
+
+def add_cache_metrics(*caches):
+    """Report the hit/miss/eviction counters and size of TTLCaches at /metrics."""
+
+    def collect():
+        lines = []
+        for stat in ('hits', 'stale_hits', 'misses', 'coalesced', 'evictions', 'expirations', 'entries', 'bytes'):
+            kind = 'gauge' if stat in ('entries', 'bytes') else 'counter'
+            name = f'pokemon_tcg_cache_{stat}' + ('_total' if kind == 'counter' else '')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{{cache="{cache.name}"}} {cache.snapshot()[stat]}' for cache in caches)
+        return lines
+
+    registry.add_collector(collect)
+
+
+def add_pool_metrics(db):
+    """Report the size and usage of the database connection pool at /metrics (QueuePool only)."""
+
+    def collect():
+        pool = db.engine.pool
+        if not hasattr(pool, 'checkedout'):
+            return [] # NullPool (pgbouncer mode) has nothing to report
+
+        lines = []
+        for stat, value in (('size', pool.size()), ('checked_out', pool.checkedout()),
+                            ('checked_in', pool.checkedin()), ('overflow', max(pool.overflow(), 0))):
+            lines.append(f'# TYPE pokemon_tcg_db_pool_{stat} gauge')
+            lines.append(f'pokemon_tcg_db_pool_{stat} {value}')
+        return lines
+
+    registry.add_collector(collect)
+
+
+def metrics_allowed(app):
+    """Return True if the current request may read /metrics."""
+
+    if app.config.get('METRICS_PUBLIC'):
+        return True
+
+    token = app.config.get('METRICS_TOKEN')
+    if not token:
+        return False
+
+    return hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())
+
+
+def init_app(app):
+    """Install the timing hooks and the /metrics endpoint on `app`."""
+
+    # engine events are global, only install them once when several apps are made (e.g. in tests)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        if 'request_start' not in g:
+            return response
+
+        total = time.perf_counter() - g.request_start
+        request_seconds.observe(total, route=route_name(), method=request.method, status=response.status_code)
+        response.headers['Server-Timing'] = server_timing_header(g.get('timings', {}), total)
+
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus metrics for this process"""
+
+        if not metrics_allowed(app):
+            abort(404)
+
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -1,8 +1,11 @@
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, DDL
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, insert
+from metrics import timed
+from passwords import hasher
 import datetime
+import db_pool
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 DEEFAULT_PROFILE_IMAGE = 'https://i1.sndcdn.com/artworks-000193803962-tla7ov-t500x500.jpg'
@@ -10,7 +13,9 @@ DEEFAULT_PROFILE_IMAGE = 'https://i1.sndcdn.com/artworks-000193803962-tla7ov-t50
 def connect_db(app):
     """Connect database to provided Flask app."""
 
-    db.app = app
+    # pool sized for the gunicorn worker settings (see db_pool.py)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', db_pool.engine_options())
+
     db.init_app(app)
 
 
@@ -35,13 +40,14 @@ class User(db.Model):
     )
 
     @classmethod
+    @timed('auth')
     def signup(cls, username, password, email):
         """Sign up user.
 
-        Hashes password and adds user to system.
+        Hashes password (in the password hashing pool, see passwords.py) and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -53,6 +59,7 @@ class User(db.Model):
         return user
 
     @classmethod
+    @timed('auth')
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
 
@@ -61,13 +68,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with a different work factor than the configured
+        BCRYPT_LOG_ROUNDS, it is replaced with a new hash (the caller commits it).
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -75,16 +87,59 @@ class User(db.Model):
 
 
 class Card(db.Model):
-    """Individual Pokemon Trading Card"""
+    """Individual Pokemon Trading Card
+
+    Mirrors the Pokemon TCG API: `data` holds the full API payload and the other
+    columns are the fields pulled out of it which are used for searching/displaying cards.
+    """
 
     __tablename__ = 'cards'
+    __table_args__ = (
+        # trigram index: fast ILIKE '%name%' / 'prefix%' searches and fuzzy matching on card names
+        db.Index('ix_cards_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Text, primary_key=True)
     name = db.Column(db.Text, nullable=False)
+    supertype = db.Column(db.Text)
+    hp = db.Column(db.Text)
+    types = db.Column(ARRAY(db.Text))
+    image_small = db.Column(db.Text)
+    image_large = db.Column(db.Text)
+    set_id = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime)
+    data = db.Column(JSONB)
+    synced_at = db.Column(db.DateTime)
 
     def __repr__(self):
         return f"<Card #{self.id}: {self.name}>"
 
+    @staticmethod
+    def values_from_api(data):
+        """Return the column values for a card from its Pokemon TCG API payload."""
+
+        images = data.get('images') or {}
+        card_set = data.get('set') or {}
+
+        return {
+            "id": data['id'],
+            "name": data['name'],
+            "supertype": data.get('supertype'),
+            "hp": data.get('hp'),
+            "types": data.get('types'),
+            "image_small": images.get('small'),
+            "image_large": images.get('large'),
+            "set_id": card_set.get('id'),
+            "updated_at": parse_api_datetime(card_set.get('updatedAt')),
+            "data": data,
+            "synced_at": datetime.datetime.now(),
+        }
+
+
+
+# the trigram index above needs the pg_trgm extension
+event.listen(Card.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
 
 
 class Favorite(db.Model):
@@ -94,7 +149,72 @@ class Favorite(db.Model):
 
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='cascade'), primary_key=True)
     card_id = db.Column(db.Text, db.ForeignKey('cards.id', ondelete='cascade'), primary_key=True)
+    # the order favorites are listed in
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now, server_default=func.now())
 
     def __repr__(self):
         return f"<Favorites | User {self.user_id} | Card {self.card_id}>"
+
+    @classmethod
+    def toggle(cls, user_id, card_id):
+        """Add the card to the user's favorites, or remove it if it is already there.
+
+        Works directly on the `favorites` table (a DELETE, then an INSERT only if nothing
+        was deleted) instead of loading the user's whole favorites collection.
+        Returns True if the card is now a favorite.
+        """
+
+        deleted = cls.query.filter_by(user_id=user_id, card_id=card_id).delete(synchronize_session=False)
+
+        if deleted:
+            return False
+
+        db.session.execute(insert(cls).values(user_id=user_id, card_id=card_id).on_conflict_do_nothing())
+        return True
+
+    @classmethod
+    def exists(cls, user_id, card_id):
+        """Return True if the card is one of the user's favorites.
+
+        A single row lookup on the (user_id, card_id) primary key, however many favorites the user has.
+        """
+
+        return db.session.query(db.exists().where(cls.user_id == user_id, cls.card_id == card_id)).scalar()
+
+    @classmethod
+    def card_ids(cls, user_id):
+        """Return the ids of the user's favorite cards (without loading the cards themselves).
+
+        Oldest favorite first.
+        """
+
+        query = db.session.query(cls.card_id).filter(cls.user_id == user_id).order_by(cls.created_at, cls.card_id)
+
+        return [row.card_id for row in query]
+
+
+
+class AppState(db.Model):
+    """Small key/value store for app bookkeeping (e.g. when the card catalog was last synced)."""
+
+    __tablename__ = 'app_state'
+
+    key = db.Column(db.Text, primary_key=True)
+    value = db.Column(JSONB, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+    def __repr__(self):
+        return f"<AppState {self.key}: {self.value}>"
+
+
+def parse_api_datetime(value):
+    """Parse a Pokemon TCG API timestamp ('2022/03/04 10:01:00') into a datetime."""
+
+    if not value:
+        return None
+
+    try:
+        return datetime.datetime.strptime(value, '%Y/%m/%d %H:%M:%S')
+    except ValueError:
+        return None
     
@@ -0,0 +1,113 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import multiprocessing
+import os
+import threading
+import bcrypt
+
+############################################################################################
+# PASSWORD HASHING
+#
+# bcrypt is deliberately slow (hundreds of milliseconds of CPU per hash), which used to run
+# on the request thread and block the worker during every signup/login/profile edit.
+# Hashes are now computed in a small process pool:
+# - at most `max_pending` hashes can be queued per worker; beyond that the request is turned
+#   away (PasswordHasherBusy) instead of letting a burst of logins starve page views
+# - the work factor (BCRYPT_LOG_ROUNDS) is configurable, and hashes made with a different
+#   work factor are replaced on the next successful login (see User.authenticate)
+
+DEFAULT_ROUNDS = 12
+
+# forkserver starts processes from a clean server process (spawn where it isn't available)
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+class PasswordHasherBusy(Exception):
+    """Too many passwords are already waiting to be hashed."""
+
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(hashed, password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class PasswordHasher:
+    """Hash and check passwords in a bounded process pool."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=2, max_pending=8, queue_timeout=2, timeout=10):
+        self.rounds = rounds
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def hash(self, password):
+        """Return the bcrypt hash of `password` using the configured work factor."""
+
+        if not password:
+            raise ValueError("Password must be non-empty.")
+
+        return self._run(_hash_password, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Return True if `password` matches the bcrypt hash `hashed`."""
+
+        if not password:
+            return False
+
+        return self._run(_check_password, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Return True if `hashed` was made with a different work factor than the configured one."""
+
+        # bcrypt hashes look like $2b$12$<salt><hash>, where 12 is the work factor
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def _run(self, func, *args):
+        # without workers (e.g. in tests), hash on the calling thread
+        if not self.workers:
+            return func(*args)
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHasherBusy()
+
+        try:
+            future = self._get_pool().submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        # the slot is held until the hash is done, even when this request stops waiting for it,
+        # so the pool's backlog never grows past `max_pending`
+        future.add_done_callback(lambda future: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PasswordHasherBusy()
+
+    def _get_pool(self):
+        # created on first use so each gunicorn worker gets its own pool after forking
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # not forked from this process, which has background threads running (and is
+                    # monkey-patched by gevent): the hashing processes only need bcrypt
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(START_METHOD))
+
+        return self._pool
+
+
+hasher = PasswordHasher(
+    rounds=int(os.environ.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)),
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+    max_pending=int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8)),
+)
@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import os
+import rendering
+import threading
+import time
+
+############################################################################################
+# CARD DETAILS PREFETCH
+#
+# After a page of search results is sent, people almost always open one of the first few
+# cards. Search results already carry each card's full data, so those cards are put in the
+# card cache, and their details are rendered ahead of time (see rendering.py), once the
+# response has gone out. The click then needs neither the database nor the Pokemon TCG API.
+#
+# Results searched on the API (before the catalog is synced) aren't saved locally, so those
+# cards are loaded like a click would load them, which requests them upstream. Those requests
+# are limited to PREFETCH_UPSTREAM_RATE a second, so prefetching can't use up the API's
+# rate limit. Cards over the budget are left for the click.
+#
+# The work runs on a small thread pool with a bounded queue: when too many searches are
+# waiting to be warmed, new ones are skipped rather than queued. Searches whose cards are
+# already warm are skipped without using the pool at all.
+
+PREFETCH_TOP_N = int(os.environ.get('PREFETCH_TOP_N', 8)) # the first two rows of the results grid
+PREFETCH_WORKERS = 2
+PREFETCH_MAX_PENDING = 32
+PREFETCH_UPSTREAM_RATE = float(os.environ.get('PREFETCH_UPSTREAM_RATE', 2))
+PREFETCH_UPSTREAM_BURST = 8
+
+prefetched_cards = metrics.registry.counter('pokemon_tcg_prefetched_cards_total', "Cards from search results warmed ahead of a click, by source (catalog, api).")
+prefetch_skipped = metrics.registry.counter('pokemon_tcg_prefetch_skipped_total', "Cards or searches not prefetched, by reason (warm, busy, budget, error).")
+
+
+class TokenBucket:
+    """Allow `rate` actions a second on average, and up to `burst` at once."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Use up one token. Returns False, without waiting, when there are none left."""
+
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if self._tokens < 1:
+                return False
+
+            self._tokens -= 1
+            return True
+
+
+class Prefetcher:
+    """Warms the card cache and the rendered card details for the top results of a search."""
+
+    def __init__(self, card_cache, load, app=None, top_n=PREFETCH_TOP_N, workers=PREFETCH_WORKERS,
+                 max_pending=PREFETCH_MAX_PENDING, upstream_budget=None):
+        """`load(card_id)` loads a card the way a click would, for results which aren't in the catalog."""
+
+        self.card_cache = card_cache
+        self.load = load
+        self.app = app
+        self.top_n = top_n
+        self.workers = workers
+        self.upstream_budget = upstream_budget or TokenBucket(PREFETCH_UPSTREAM_RATE, PREFETCH_UPSTREAM_BURST)
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Render the card details with `app`'s templates."""
+
+        self.app = app
+
+    def is_warm(self, card):
+        return card.id in self.card_cache and rendering.card_version(card) in rendering.fragment_cache
+
+    def schedule(self, cards, from_catalog=True):
+        """Warm the first `top_n` of `cards` (CardRecords) in the background.
+
+        `from_catalog` is False when the search was answered by the API.
+        """
+
+        cold = [card for card in cards[:self.top_n] if not self.is_warm(card)]
+
+        if not cold:
+            prefetch_skipped.inc(reason='warm')
+            return
+
+        if not self._slots.acquire(blocking=False):
+            prefetch_skipped.inc(reason='busy')
+            return
+
+        try:
+            self._get_pool().submit(self._warm, cold, from_catalog)
+        except RuntimeError:
+            # the pool is shutting down
+            self._slots.release()
+
+    def _warm(self, cards, from_catalog):
+        try:
+            with self.app.app_context():
+                for card in cards:
+                    # a click may have got there first
+                    if self.is_warm(card):
+                        continue
+
+                    if card.id not in self.card_cache:
+                        if from_catalog:
+                            self.card_cache.set(card.id, card)
+
+                        elif not self.upstream_budget.take():
+                            prefetch_skipped.inc(reason='budget')
+                            continue
+
+                        else:
+                            try:
+                                card = self.load(card.id)
+                            except Exception:
+                                # the click will try again (and show the error)
+                                prefetch_skipped.inc(reason='error')
+                                continue
+
+                    rendering.render_card_details(card)
+                    prefetched_cards.inc(source='catalog' if from_catalog else 'api')
+        finally:
+            self._slots.release()
+
+    def _get_pool(self):
+        # created on first use so each gunicorn worker gets its own threads after forking
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prefetch')
+
+        return self._pool
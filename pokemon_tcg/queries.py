@@ -0,0 +1,134 @@
+from flask import g, has_request_context, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from collections import Counter
+from contextlib import contextmanager
+import metrics
+import threading
+
+############################################################################################
+# QUERY COUNTING
+#
+# Records the SQL statements each request runs, so a change that adds queries to a page
+# doesn't go unnoticed:
+# - queries per request are reported by route at /metrics (and as `db` in Server-Timing)
+# - tests can give a block of code a query budget (QueryBudgetMixin.assertMaxQueries)
+# - with QUERY_WARNINGS on (development), a request which lazy loads the same relationship
+#   more than once (e.g. `User.favorites`), or repeats the same statement N_PLUS_ONE_THRESHOLD
+#   times, logs a warning listing the statements
+
+N_PLUS_ONE_THRESHOLD = 3
+
+queries_per_request = metrics.registry.histogram('pokemon_tcg_db_queries_per_request', "Database queries run by each request, by route.",
+                                                 buckets=(0, 1, 2, 3, 4, 5, 10, 20, 50))
+
+_local = threading.local()
+
+
+class QueryLog:
+    """SQL statements, and the relationships which were lazy loaded to run them."""
+
+    def __init__(self):
+        self.statements = []
+        self.lazy_loads = Counter()
+
+    def __len__(self):
+        return len(self.statements)
+
+    def repeated_statements(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return {statement: count for statement, count in Counter(self.statements).items() if count >= threshold}
+
+    def repeated_lazy_loads(self):
+        return {relationship: count for relationship, count in self.lazy_loads.items() if count > 1}
+
+    def format(self):
+        return '\n'.join(f'  {i}. {statement}' for i, statement in enumerate(self.statements, 1))
+
+
+def _active_logs():
+    logs = list(getattr(_local, 'logs', ()))
+
+    if has_request_context() and 'query_log' in g:
+        logs.append(g.query_log)
+
+    return logs
+
+
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    for log in _active_logs():
+        log.statements.append(' '.join(statement.split()))
+
+
+def _record_lazy_load(orm_execute_state):
+    if orm_execute_state.is_relationship_load and orm_execute_state.lazy_loaded_from is not None:
+        relationship = str(orm_execute_state.loader_strategy_path[-1]) # e.g. 'User.favorites'
+        for log in _active_logs():
+            log.lazy_loads[relationship] += 1
+
+
+@contextmanager
+def count_queries():
+    """Record the statements run on this thread inside the `with` block.
+
+        with count_queries() as queries:
+            client.get('/user')
+        len(queries), queries.statements
+    """
+
+    log = QueryLog()
+    logs = _local.__dict__.setdefault('logs', [])
+    logs.append(log)
+
+    try:
+        yield log
+    finally:
+        logs.remove(log)
+
+
+class QueryBudgetMixin:
+    """TestCase mixin: fail a test when a block of code runs more queries than expected."""
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with count_queries() as queries:
+            yield queries
+
+        if len(queries) > budget:
+            self.fail(f"{len(queries)} queries run, the budget is {budget}:\n{queries.format()}")
+
+
+def warn_about_queries(route, log):
+    """Log the N+1 patterns in a request's queries."""
+
+    for relationship, count in log.repeated_lazy_loads().items():
+        current_app.logger.warning("%s lazy loaded %s %d times (%d queries):\n%s", route, relationship, count, len(log), log.format())
+
+    for statement, count in log.repeated_statements().items():
+        current_app.logger.warning("%s ran the same statement %d times, is something loaded in a loop?\n  %s", route, count, statement)
+
+
+def init_app(app):
+    """Record the queries of every request on `app`."""
+
+    # engine and session events are global, only install them once when several apps are made (e.g. in tests)
+    if not event.contains(Engine, 'before_cursor_execute', _record_statement):
+        event.listen(Engine, 'before_cursor_execute', _record_statement)
+        event.listen(Session, 'do_orm_execute', _record_lazy_load)
+
+    @app.before_request
+    def start_query_log():
+        g.query_log = QueryLog()
+
+    @app.after_request
+    def finish_query_log(response):
+        log = g.pop('query_log', None)
+        if log is None:
+            return response
+
+        queries_per_request.observe(len(log), route=metrics.route_name())
+
+        if app.config.get('QUERY_WARNINGS'):
+            warn_about_queries(metrics.route_name(), log)
+
+        return response
@@ -0,0 +1,114 @@
+from dataclasses import dataclass
+
+############################################################################################
+# COMPACT CARD RECORDS
+#
+# The API returns a lot more than the templates show (legalities, every price variant,
+# cardmarket data, set legalities...). Cards are parsed straight into these small slotted
+# records, which is what gets cached in memory and passed to the templates.
+# The full API payload is only kept in the `cards` table (see catalog.py).
+
+
+@dataclass(frozen=True, slots=True)
+class Attack:
+    name: str
+    cost: tuple
+    damage: str
+    text: str
+
+
+@dataclass(frozen=True, slots=True)
+class Ability:
+    name: str
+    text: str
+
+
+@dataclass(frozen=True, slots=True)
+class Prices:
+    """TCGplayer holofoil prices (in USD)."""
+
+    market: float
+    low: float
+    mid: float
+    high: float
+
+
+@dataclass(frozen=True, slots=True)
+class CardRecord:
+    """The parts of a Pokemon TCG API card that the app displays."""
+
+    id: str
+    name: str
+    image_small: str
+    image_large: str
+    supertype: str = None
+    subtype: str = None
+    hp: str = None
+    types: tuple = ()
+    ability: Ability = None
+    attacks: tuple = () # the first two attacks
+    rule: str = None
+    weakness_type: str = None
+    weakness_value: str = None
+    retreat_cost: tuple = ()
+    artist: str = None
+    rarity: str = None
+    pokedex_number: int = None
+    number: str = None
+    set_name: str = None
+    set_total: int = None
+    set_release_date: str = None
+    set_symbol: str = None
+    set_updated_at: str = None
+    tcgplayer_url: str = None
+    prices_updated_at: str = None
+    holofoil: Prices = None
+
+    @classmethod
+    def from_api(cls, data):
+        """Parse a card from the Pokemon TCG API (or the JSON stored in the `cards` table)."""
+
+        images = data.get('images') or {}
+        card_set = data.get('set') or {}
+        tcgplayer = data.get('tcgplayer') or {}
+        holofoil = (tcgplayer.get('prices') or {}).get('holofoil')
+        abilities = data.get('abilities') or []
+        weaknesses = data.get('weaknesses') or []
+
+        return cls(
+            id=data['id'],
+            name=data['name'],
+            image_small=images.get('small'),
+            image_large=images.get('large'),
+            supertype=data.get('supertype'),
+            subtype=first(data.get('subtypes')),
+            hp=data.get('hp'),
+            types=tuple(data.get('types') or ()),
+            ability=Ability(abilities[0].get('name'), abilities[0].get('text')) if abilities else None,
+            attacks=tuple(
+                Attack(attack.get('name'), tuple(attack.get('cost') or ()), attack.get('damage'), attack.get('text'))
+                for attack in (data.get('attacks') or [])[:2]
+            ),
+            rule=first(data.get('rules')),
+            weakness_type=weaknesses[0].get('type') if weaknesses else None,
+            weakness_value=weaknesses[0].get('value') if weaknesses else None,
+            retreat_cost=tuple(data.get('retreatCost') or ()),
+            artist=data.get('artist'),
+            rarity=data.get('rarity'),
+            pokedex_number=first(data.get('nationalPokedexNumbers')),
+            number=data.get('number'),
+            set_name=card_set.get('name'),
+            set_total=card_set.get('total'),
+            set_release_date=card_set.get('releaseDate'),
+            set_symbol=(card_set.get('images') or {}).get('symbol'),
+            set_updated_at=card_set.get('updatedAt'),
+            tcgplayer_url=tcgplayer.get('url'),
+            prices_updated_at=tcgplayer.get('updatedAt'),
+            holofoil=Prices(holofoil.get('market'), holofoil.get('low'), holofoil.get('mid'), holofoil.get('high')) if holofoil else None,
+        )
+
+
+def first(values):
+    """Return the first item of a list from the API, or None if it is missing/empty."""
+
+    return values[0] if values else None
@@ -0,0 +1,116 @@
+from flask import render_template, request, session, g, make_response
+from markupsafe import Markup
+from cache import TTLCache
+import glob
+import hashlib
+import os
+
+############################################################################################
+# CARD PAGE RENDERING
+#
+# The card details page is the same for every visitor apart from the favorite button.
+# The card details are rendered once per card version and kept in memory; each page view
+# only renders the (small) page around them with the user's favorite button.
+#
+# Card pages also carry ETags, so a browser (or a proxy in front of gunicorn) that already
+# has the current version gets a 304 without anything being rendered. The ETags include
+# RENDER_VERSION, so a deploy which changes how pages are rendered (a template, an image url)
+# doesn't keep answering 304 for pages rendered by the old code.
+
+# energy type -> icon, used for HP types, attack costs, weaknesses and retreat costs
+ENERGY_ICONS = {
+    energy: f'/static/images/Energy/{energy.lower()}.png'
+    for energy in ('Colorless', 'Darkness', 'Dragon', 'Fairy', 'Fighting', 'Fire', 'Grass',
+                   'Lightning', 'Metal', 'Psychic', 'Water')
+}
+
+# how long browsers/proxies may reuse a card page for anonymous visitors without checking back
+PUBLIC_MAX_AGE = 5 * 60
+
+def code_version(root=os.path.dirname(os.path.abspath(__file__))):
+    """Return a hash of the templates and Python modules, which decide what a page looks like."""
+
+    paths = glob.glob(os.path.join(root, 'templates', '**', '*.html'), recursive=True) + glob.glob(os.path.join(root, '*.py'))
+    digest = hashlib.sha1()
+
+    for path in sorted(paths):
+        digest.update(os.path.relpath(path, root).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()[:12]
+
+
+RENDER_VERSION = code_version()
+
+fragment_cache = TTLCache('card_html', max_entries=2048, max_bytes=32 * 1024 * 1024, ttl=60 * 60, stale_ttl=0)
+
+
+def energy_icon(energy_type):
+    """Jinja filter: return the icon path for an energy type ('' if there is no icon for it)."""
+
+    return ENERGY_ICONS.get(energy_type, '')
+
+
+def card_version(card):
+    """Return a string which changes whenever the card's displayed data changes.
+
+    Card data only changes when its set is updated or its prices are refreshed.
+    """
+
+    return f"{card.id}:{card.set_updated_at or ''}:{card.prices_updated_at or ''}"
+
+
+def render_card_details(card):
+    """Return the rendered card details for the CardRecord `card`, from the cache when this version was already rendered."""
+
+    key = card_version(card)
+
+    return fragment_cache.get_or_load(key, lambda: Markup(render_template('card/_card_details.html', card=card)))
+
+
+def conditional_page(etag_parts, render):
+    """Return the page produced by `render()` with ETag/Cache-Control headers.
+
+    `etag_parts` must change whenever the page's data would change (RENDER_VERSION is
+    added for changes to the code which renders it). If the browser already has
+    this version (If-None-Match), a 304 is returned and `render` is never called.
+    Logged in users get a private response which includes them in the ETag, anonymous
+    visitors get one that proxies may share for PUBLIC_MAX_AGE seconds.
+    """
+
+    etag_parts = (RENDER_VERSION,) + tuple(etag_parts)
+
+    if g.user:
+        etag_parts += (g.user.id, g.user.username, g.user.profile_image)
+
+    etag = hashlib.sha1(repr(tuple(etag_parts)).encode()).hexdigest()
+
+    # a page with flash messages waiting to be shown can't be answered from the browser's copy
+    cacheable = '_flashes' not in session
+
+    if cacheable and request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+
+    if cacheable:
+        response.set_etag(etag, weak=True)
+
+        if g.user:
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+        else:
+            response.cache_control.public = True
+            response.cache_control.max_age = PUBLIC_MAX_AGE
+
+    # the page is different for logged in users
+    response.vary.add('Cookie')
+
+    return response
+
+
+def init_app(app):
+    """Register the template filters on `app`."""
+
+    app.jinja_env.filters['energy_icon'] = energy_icon
@@ -1,8 +1,18 @@
 from models import *
 from app import app
+from load_catalog import load_catalog
+import sys
+
+# Sets up a new database. This drops every table (users and favorites included):
+# to upgrade an existing database, run upgrade_db.py instead.
 
 # Clear any old tables
 db.drop_all()
 
 # Create all tables
-db.create_all()
\ No newline at end of file
+db.create_all()
+
+# Fill the card catalog from a Pokemon TCG data dump, if one is given:
+# python seed.py path/to/pokemon-tcg-data
+if len(sys.argv) > 1:
+    load_catalog(sys.argv[1])
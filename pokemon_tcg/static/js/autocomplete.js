@@ -0,0 +1,29 @@
+// Typeahead for the card search boxes.
+// Suggestions come from /api/autocomplete (answered from the local card catalog) and are shown in a <datalist>.
+
+const suggestionList = document.querySelector('#card-name-suggestions');
+let autocompleteTimer = null;
+
+async function showSuggestions(text) {
+    const response = await fetch(`/api/autocomplete?q=${encodeURIComponent(text)}`);
+
+    if (!response.ok) {
+        return;
+    }
+
+    const data = await response.json();
+
+    suggestionList.replaceChildren(...data.suggestions.map(function (name) {
+        const option = document.createElement('option');
+        option.value = name;
+        return option;
+    }));
+}
+
+for (const input of document.querySelectorAll('input[name="pokemon-search"]')) {
+    input.addEventListener('input', function () {
+        // wait for a pause in typing instead of sending a request per keystroke
+        clearTimeout(autocompleteTimer);
+        autocompleteTimer = setTimeout(showSuggestions, 150, input.value.trim());
+    });
+}
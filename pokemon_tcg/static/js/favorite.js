@@ -0,0 +1,39 @@
+// Favorite button on the card details page.
+// Toggles the favorite through the JSON endpoint instead of submitting the form and reloading the page.
+// If anything else goes wrong, the form is submitted normally.
+
+const favoriteForm = document.querySelector('#favorite-card-form');
+
+if (favoriteForm) {
+    favoriteForm.addEventListener('submit', async function (evt) {
+        evt.preventDefault();
+
+        const button = favoriteForm.querySelector('button');
+        button.disabled = true;
+
+        try {
+            const response = await fetch(`/api${favoriteForm.getAttribute('action')}`, { method: 'POST' });
+
+            // the card can't be favorited (right now), submitting the form would only get the same answer
+            if (response.status === 404 || response.status === 503) {
+                const data = await response.json();
+                button.querySelector('.favorite-label').textContent = data.error;
+                return;
+            }
+
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+
+            const data = await response.json();
+
+            button.classList.toggle('btn-danger', data.favorited);
+            button.classList.toggle('btn-info', !data.favorited);
+            button.querySelector('.favorite-label').textContent = data.favorited ? 'Remove Favorite' : 'Add Favorite';
+        } catch (err) {
+            favoriteForm.submit();
+        } finally {
+            button.disabled = false;
+        }
+    });
+}
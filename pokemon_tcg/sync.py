@@ -0,0 +1,8 @@
+from app import app, api
+from catalog import sync_catalog
+
+# Pull the whole catalog (with today's prices) into the local catalog.
+# Schedule it to run daily (e.g. with cron).
+count = sync_catalog(api)
+
+print(f"Synced {count} cards.")
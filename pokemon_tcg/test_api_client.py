@@ -0,0 +1,136 @@
+"""Pokemon TCG API client tests."""
+
+# run these tests with:
+# python -m unittest test_api_client.py
+
+from unittest import TestCase
+import requests
+
+from api_client import PokemonTCGClient, CircuitBreaker, UpstreamError, CardNotFound, CircuitOpen
+
+
+class FakeResponse:
+    """Stand-in for a requests.Response."""
+
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+
+class FakeSession(requests.Session):
+    """Session which returns (or raises) the queued responses instead of making requests."""
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class PokemonTCGClientTestCase(TestCase):
+    """Test the API client's retries and circuit breaker."""
+
+    def make_client(self, responses, **kwargs):
+        self.session = FakeSession(responses)
+        return PokemonTCGClient('https://api.test/v2/cards', session=self.session, backoff=0, **kwargs)
+
+    def test_get(self):
+        """Requests are sent with a timeout and the JSON body is returned"""
+
+        client = self.make_client([FakeResponse(200, {"data": {"id": "xy1-1"}})])
+
+        self.assertEqual(client.get('xy1-1'), {"data": {"id": "xy1-1"}})
+
+        url, kwargs = self.session.calls[0]
+        self.assertEqual(url, 'https://api.test/v2/cards/xy1-1')
+        self.assertIsNotNone(kwargs['timeout'])
+
+    def test_retry_then_succeed(self):
+        """Timeouts and 5xx responses are retried"""
+
+        client = self.make_client([requests.Timeout(), FakeResponse(503), FakeResponse(200, {"data": []})])
+
+        self.assertEqual(client.get(params={"q": "name:pikachu"}), {"data": []})
+        self.assertEqual(len(self.session.calls), 3)
+
+    def test_not_found(self):
+        """A 404 raises CardNotFound without retrying"""
+
+        client = self.make_client([FakeResponse(404)])
+
+        with self.assertRaises(CardNotFound):
+            client.get('1234')
+        self.assertEqual(len(self.session.calls), 1)
+
+    def test_circuit_opens(self):
+        """After repeated failures the client stops calling the API"""
+
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+        client = self.make_client([requests.ConnectionError()] * 2, retries=0, breaker=breaker)
+
+        for _ in range(2):
+            with self.assertRaises(UpstreamError):
+                client.get()
+
+        with self.assertRaises(CircuitOpen):
+            client.get()
+        self.assertEqual(len(self.session.calls), 2)
+
+    def test_other_errors(self):
+        """Broken bodies and invalid JSON are retried and raise UpstreamError"""
+
+        client = self.make_client([requests.exceptions.ChunkedEncodingError(), FakeResponse(200, ValueError("not JSON"))], retries=1)
+
+        with self.assertRaises(UpstreamError):
+            client.get()
+        self.assertEqual(len(self.session.calls), 2)
+
+    def test_failed_trial_closes_again(self):
+        """A half-open trial which fails with any error lets the next trial through"""
+
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30, clock=lambda: now[0])
+        client = self.make_client([requests.ConnectionError(), requests.exceptions.ChunkedEncodingError(),
+                                   FakeResponse(200, {"data": []})], retries=0, breaker=breaker)
+
+        with self.assertRaises(UpstreamError):
+            client.get()
+
+        now[0] = 31
+        with self.assertRaises(UpstreamError):
+            client.get()
+
+        now[0] = 62
+        self.assertEqual(client.get(), {"data": []})
+        self.assertFalse(breaker.is_open)
+
+
+class CircuitBreakerTestCase(TestCase):
+    """Test the circuit breaker on its own."""
+
+    def test_half_open_trial(self):
+        """Once the reset period has passed a single trial request is allowed"""
+
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30, clock=lambda: now[0])
+        breaker.record_failure()
+
+        self.assertFalse(breaker.allow())
+
+        now[0] = 31
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
@@ -0,0 +1,58 @@
+"""App factory tests."""
+
+# run these tests with:
+# python -m unittest test_app_factory.py
+
+from unittest import TestCase
+
+from app import create_app
+from config import TestingConfig
+
+
+class AppFactoryTestCase(TestCase):
+    """Test building the app for each environment."""
+
+    def test_production(self):
+        """Production has no debug toolbar hooks"""
+
+        app = create_app('production')
+
+        self.assertFalse(app.debug)
+        self.assertNotIn('process_request', [func.__name__ for func in app.before_request_funcs[None]])
+        self.assertIn('views.homepage', app.view_functions)
+
+    def test_development(self):
+        app = create_app('development')
+
+        self.assertTrue(app.debug)
+        self.assertIn('process_request', [func.__name__ for func in app.before_request_funcs[None]])
+
+    def test_config_class(self):
+        app = create_app(TestingConfig)
+
+        self.assertTrue(app.testing)
+        self.assertEqual(app.config['SQLALCHEMY_DATABASE_URI'], 'postgresql:///pokemon-tcg-test')
+
+    def test_background_work_per_app(self):
+        """Each app has its own background workers, bound to it"""
+
+        first = create_app('testing')
+        second = create_app('testing')
+
+        for name in ('featured_cards', 'card_writer', 'prefetcher'):
+            self.assertIs(first.extensions[name].app, first)
+            self.assertIs(second.extensions[name].app, second)
+
+    def test_metrics_need_token(self):
+        """/metrics is hidden in production unless the request has the token"""
+
+        app = create_app('production')
+        client = app.test_client()
+
+        self.assertEqual(client.get('/metrics').status_code, 404)
+
+        app.config['METRICS_TOKEN'] = 'secret'
+        self.assertEqual(client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 404)
+        self.assertEqual(client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code, 200)
+
+        self.assertEqual(create_app('development').test_client().get('/metrics').status_code, 200)
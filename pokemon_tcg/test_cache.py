@@ -0,0 +1,181 @@
+"""API response cache tests."""
+
+# run these tests with:
+# python -m unittest test_cache.py
+
+import threading
+import time
+from unittest import TestCase
+
+from cache import TTLCache, MISSING
+
+
+class FakeClock:
+    """Clock that only moves when the test tells it to."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTestCase(TestCase):
+    """Test the TTL + LRU cache."""
+
+    def setUp(self):
+        """Create a small cache with a controllable clock."""
+
+        self.clock = FakeClock()
+        self.cache = TTLCache('test', max_entries=3, ttl=10, stale_ttl=5, clock=self.clock)
+
+    def test_get_and_set(self):
+        """Values can be stored and read back until they expire"""
+
+        self.cache.set('pikachu', {"name": "Pikachu"})
+
+        self.assertEqual(self.cache.get('pikachu'), {"name": "Pikachu"})
+        self.assertEqual(self.cache.stats["hits"], 1)
+
+        self.clock.now = 11
+        self.assertIs(self.cache.get('pikachu'), MISSING)
+        self.assertEqual(self.cache.stats["misses"], 1)
+
+    def test_lru_eviction_by_count(self):
+        """The least recently used entry is evicted once max_entries is reached"""
+
+        for name in ['bulbasaur', 'charmander', 'squirtle']:
+            self.cache.set(name, name)
+
+        # reading bulbasaur makes charmander the least recently used entry
+        self.cache.get('bulbasaur')
+        self.cache.set('pikachu', 'pikachu')
+
+        self.assertIn('bulbasaur', self.cache)
+        self.assertNotIn('charmander', self.cache)
+        self.assertEqual(self.cache.stats["evictions"], 1)
+
+    def test_eviction_by_size(self):
+        """Entries are evicted once the cache is over its byte budget"""
+
+        cache = TTLCache('test', max_entries=100, max_bytes=2000, clock=self.clock)
+        cache.set('one', 'x' * 800)
+        cache.set('two', 'x' * 800)
+        cache.set('three', 'x' * 800)
+
+        self.assertNotIn('one', cache)
+        self.assertLessEqual(cache.current_bytes, 2000)
+
+    def test_get_or_load(self):
+        """The loader only runs on a miss"""
+
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return ['charizard']
+
+        self.assertEqual(self.cache.get_or_load('charizard', loader), ['charizard'])
+        self.assertEqual(self.cache.get_or_load('charizard', loader), ['charizard'])
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_while_revalidate(self):
+        """An expired entry inside its stale window is served while it is refreshed"""
+
+        self.cache.set('mew', 'old')
+        self.clock.now = 12
+
+        value = self.cache.get_or_load('mew', lambda: 'new')
+
+        self.assertEqual(value, 'old')
+        self.assertEqual(self.cache.stats["stale_hits"], 1)
+
+        # the background refresh replaces the stale value
+        for _ in range(100):
+            if self.cache.get('mew', count=False) == 'new':
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.cache.get('mew'), 'new')
+
+    def test_concurrent_misses_share_one_load(self):
+        """Requests for a key which is already being loaded wait for that load"""
+
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def loader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'pikachu'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_load('pikachu', loader)))
+                   for _ in range(5)]
+
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+
+        # let the waiting requests line up behind the first one
+        for _ in range(100):
+            if self.cache.snapshot()["coalesced"] == 4:
+                break
+            time.sleep(0.01)
+
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, ['pikachu'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_cached_errors(self):
+        """Errors listed in `errors` are raised from the cache until `error_ttl` passes"""
+
+        calls = []
+
+        def loader():
+            calls.append(1)
+            raise KeyError('missingno')
+
+        for _ in range(3):
+            with self.assertRaises(KeyError):
+                self.cache.get_or_load('missingno', loader, errors=(KeyError,), error_ttl=2)
+
+        self.assertEqual(len(calls), 1)
+        self.assertNotIn('missingno', self.cache)
+
+        self.clock.now = 3
+        with self.assertRaises(KeyError):
+            self.cache.get_or_load('missingno', loader, errors=(KeyError,), error_ttl=2)
+        self.assertEqual(len(calls), 2)
+
+    def test_uncached_errors(self):
+        """Other errors are not cached"""
+
+        calls = []
+
+        def loader():
+            calls.append(1)
+            raise ValueError()
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.cache.get_or_load('mew', loader, errors=(KeyError,))
+
+        self.assertEqual(len(calls), 2)
+
+    def test_ttl_function(self):
+        """The ttl can depend on the loaded value"""
+
+        self.cache.get_or_load('empty', lambda: [], ttl=lambda value: 1 if not value else None)
+        self.cache.get_or_load('full', lambda: ['mew'], ttl=lambda value: 1 if not value else None)
+
+        self.clock.now = 2
+
+        self.assertNotIn('empty', self.cache)
+        self.assertIn('full', self.cache)
@@ -5,12 +5,14 @@
 
 import os
 from unittest import TestCase
+from unittest.mock import patch
 
 from models import db, connect_db, Card
+from queries import QueryBudgetMixin
 
 os.environ['DATABASE_URL'] = "postgresql:///pokemon-tcg-test"
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, card_cache
 
 db.drop_all()
 db.create_all()
@@ -18,7 +20,7 @@ db.create_all()
 app.config['WTF_CSRF_ENABLED'] = False
 
 
-class CardViewTestCase(TestCase):
+class CardViewTestCase(QueryBudgetMixin, TestCase):
     """Test views for cards."""
 
     def setUp(self):
@@ -48,6 +50,62 @@ class CardViewTestCase(TestCase):
             self.assertIn("Search results for ", str(res.data))
 
 
+    def test_show_search_results_page(self):
+        """Search results are split into pages"""
+
+        with self.client as client:
+            res = client.get('/cards?pokemon-search=pikachu&page=2')
+
+            self.assertEqual(res.status_code, 200)
+            self.assertIn("Search results for ", str(res.data))
+            self.assertIn('aria-label="Search results pages"', str(res.data))
+
+    def test_search_results_json(self):
+        """Search results are available one page at a time as JSON"""
+
+        with self.client as client:
+            res = client.get('/api/cards?pokemon-search=pikachu')
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json['page'], 1)
+            self.assertLessEqual(len(res.json['data']), res.json['pageSize'])
+            self.assertIn('page=2', res.json['next'])
+
+    def test_search_results_json_invalid(self):
+        """Invalid searches are rejected by the JSON endpoint"""
+
+        with self.client as client:
+            res = client.get('/api/cards?pokemon-search=123')
+
+            self.assertEqual(res.status_code, 400)
+
+    def test_search_name_with_punctuation(self):
+        """Card names with punctuation can be searched"""
+
+        with self.client as client:
+            res = client.get('/cards?pokemon-search=Mr. Mime')
+
+            self.assertEqual(res.status_code, 200)
+            self.assertIn("Search results for ", str(res.data))
+
+    def test_autocomplete(self):
+        """Card names starting with (or close to) the typed text are suggested"""
+
+        db.session.add_all([Card(id="one", name="Charizard"), Card(id="two", name="Charmander"), Card(id="three", name="Pikachu")])
+        db.session.commit()
+
+        with self.client as client:
+            res = client.get('/api/autocomplete?q=char')
+
+            self.assertEqual(res.status_code, 200)
+            self.assertIn("Charizard", res.json['suggestions'])
+            self.assertIn("Charmander", res.json['suggestions'])
+            self.assertNotIn("Pikachu", res.json['suggestions'])
+
+            # too short to suggest anything
+            res = client.get('/api/autocomplete?q=c')
+            self.assertEqual(res.json['suggestions'], [])
+
     def test_show_invalid_card_result(self):
         """Try to route to a card that doesn't exist in database"""
         with self.client as client:
@@ -75,6 +133,14 @@ class CardViewTestCase(TestCase):
             self.assertIn("Flip a coin until you get tails. This attack does 30 damage for each heads.", str(res.data))
 
 
+    def test_show_card_query_budget(self):
+        """An anonymous card page reads at most the card from the database"""
+
+        with self.client as client:
+            with self.assertMaxQueries(1):
+                client.get(f'/cards/swshp-SWSH020')
+
+
     def test_show_invalid_card(self):
         """Try to route to a card that doesn't exist in database"""
         with self.client as client:
@@ -85,6 +151,41 @@ class CardViewTestCase(TestCase):
             self.assertEqual(res.status_code, 200)
             self.assertIn("Invalid search. Please try something else", str(res.data))
 
+    def test_show_invalid_card_cached(self):
+        """A card id which doesn't exist is only requested from the API once"""
+
+        with self.client as client:
+            client.get('/cards/missing-1234')
+            self.assertIn('missing-1234', card_cache._entries)
+
+            res = client.get('/cards/missing-1234', follow_redirects = True)
+            self.assertIn("Invalid search. Please try something else", str(res.data))
+
+    def test_show_card_not_modified(self):
+        """A browser which already has the current version of a card page gets a 304"""
+
+        with self.client as client:
+            res = client.get(f'/cards/swshp-SWSH020')
+
+            self.assertIsNotNone(res.headers.get('ETag'))
+            self.assertIn("public", res.headers['Cache-Control'])
+
+            res = client.get(f'/cards/swshp-SWSH020', headers={"If-None-Match": res.headers['ETag']})
+
+            self.assertEqual(res.status_code, 304)
+            self.assertEqual(res.data, b"")
+
+    def test_show_card_new_release(self):
+        """After a deploy which changes the templates, browsers get the newly rendered page"""
+
+        with self.client as client:
+            etag = client.get(f'/cards/swshp-SWSH020').headers['ETag']
+
+            with patch('rendering.RENDER_VERSION', 'next-release'):
+                res = client.get(f'/cards/swshp-SWSH020', headers={"If-None-Match": etag})
+
+            self.assertEqual(res.status_code, 200)
+
 # #######################################################################
 # Test Invalid Routes (404, 405 errors)
 
@@ -112,4 +213,29 @@ class CardViewTestCase(TestCase):
         self.assertIn("METHOD NOT ALLOWED", str(res.data))
         self.assertIn("Nice Try...", str(res.data))
 
-    
+# #######################################################################
+# Request timing and metrics
+
+    def test_server_timing_header(self):
+        """Every response says where its time was spent"""
+
+        with self.client as client:
+            res = client.get('/cards/swshp-SWSH020')
+
+        self.assertIn("total;dur=", res.headers['Server-Timing'])
+        self.assertIn("render;dur=", res.headers['Server-Timing'])
+
+    def test_metrics_endpoint(self):
+        """Per-route latency histograms are available to Prometheus, with the metrics token"""
+
+        app.config['METRICS_TOKEN'] = 'test-token'
+
+        with self.client as client:
+            client.get('/cards/swshp-SWSH020')
+            self.assertEqual(client.get('/metrics').status_code, 404)
+
+            res = client.get('/metrics', headers={'Authorization': 'Bearer test-token'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('pokemon_tcg_request_seconds_count{method="GET",route="/cards/<id>",status="200"}', str(res.data))
+        self.assertIn('pokemon_tcg_db_queries_total', str(res.data))
@@ -0,0 +1,131 @@
+"""Card catalog tests."""
+
+# run these tests with:
+# python -m unittest test_catalog.py
+
+import datetime
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask
+
+from catalog import CardRefresher, CardWriteBuffer, CatalogWriteError, is_stale, REFRESH_AFTER
+
+
+class FakeWriter:
+    def __init__(self):
+        self.cards = []
+
+    def add(self, card):
+        self.cards.append(card)
+
+
+class CardRefresherTestCase(TestCase):
+    """Test refreshing stored cards in the background."""
+
+    def test_is_stale(self):
+        now = datetime.datetime.now()
+
+        self.assertTrue(is_stale(None))
+        self.assertTrue(is_stale(now - REFRESH_AFTER - datetime.timedelta(minutes=1)))
+        self.assertFalse(is_stale(now - datetime.timedelta(hours=1)))
+
+    def test_refresh(self):
+        writer = FakeWriter()
+        refreshed = []
+        refresher = CardRefresher(lambda card_id: {"id": card_id, "name": "Pikachu"}, writer, on_refresh=refreshed.append)
+
+        refresher.refresh("base1-58")
+        refresher._pool.shutdown(wait=True)
+
+        self.assertEqual(writer.cards, [{"id": "base1-58", "name": "Pikachu"}])
+        self.assertEqual([card.id for card in refreshed], ["base1-58"])
+
+    def test_refresh_once(self):
+        """A card already being refreshed isn't requested again"""
+
+        release = threading.Event()
+        fetched = []
+
+        def fetch(card_id):
+            fetched.append(card_id)
+            release.wait(5)
+            return {"id": card_id, "name": "Pikachu"}
+
+        refresher = CardRefresher(fetch, FakeWriter())
+        refresher.refresh("base1-58")
+        refresher.refresh("base1-58")
+        release.set()
+        refresher._pool.shutdown(wait=True)
+
+        self.assertEqual(fetched, ["base1-58"])
+
+    def test_errors(self):
+        """A failed request leaves the card free to be refreshed again"""
+
+        def fetch(card_id):
+            raise ConnectionError()
+
+        refresher = CardRefresher(fetch, FakeWriter())
+        refresher.refresh("base1-58")
+        refresher._pool.shutdown(wait=True)
+
+        self.assertEqual(refresher._pending, set())
+
+
+class CardWriteBufferTestCase(TestCase):
+    """Test saving, retrying and dropping buffered cards."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.writer = CardWriteBuffer(self.app, max_attempts=2)
+        self.writer._pending = {"base1-58": {"id": "base1-58", "name": "Pikachu"}}
+
+    def test_failed_saves_dropped(self):
+        with patch('catalog.save_cards', side_effect=RuntimeError("no cards table")):
+            with self.assertLogs(self.app.logger, 'ERROR') as logs:
+                with self.assertRaises(CatalogWriteError):
+                    self.writer.flush()
+
+                # kept for the next flush
+                self.assertIn("base1-58", self.writer._pending)
+
+                with self.assertRaises(CatalogWriteError):
+                    self.writer.flush()
+
+        self.assertEqual(self.writer._pending, {})
+        self.assertIn("Dropped 1 cards after 2 failed saves: base1-58", logs.output[-1])
+
+    def test_in_flight_cards(self):
+        """Cards being saved can still be read, and flush(card_id) waits for their commit"""
+
+        committing = threading.Event()
+        commit = threading.Event()
+        saved = []
+
+        def save_cards(cards):
+            committing.set()
+            commit.wait(5)
+            saved.extend(card['id'] for card in cards)
+
+        with patch('catalog.save_cards', side_effect=save_cards):
+            background = threading.Thread(target=self.writer.flush)
+            background.start()
+            committing.wait(5)
+
+            self.assertEqual(self.writer.get("base1-58")["name"], "Pikachu")
+
+            favorite = threading.Thread(target=self.writer.flush, args=("base1-58",))
+            favorite.start()
+            favorite.join(0.05)
+            self.assertTrue(favorite.is_alive()) # waiting for the commit
+
+            commit.set()
+            background.join(5)
+            favorite.join(5)
+
+        self.assertFalse(favorite.is_alive())
+        self.assertEqual(saved, ["base1-58"])
+        self.assertIsNone(self.writer.get("base1-58"))
+
@@ -0,0 +1,56 @@
+"""Database pool settings tests."""
+
+# run these tests with:
+# python -m unittest test_db_pool.py
+
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from db_pool import engine_options, pool_size, TimedQueuePool
+import metrics
+
+
+class DBPoolTestCase(TestCase):
+    """Test sizing the connection pool from the gunicorn settings."""
+
+    def test_pool_size_sync_workers(self):
+        """Sync workers handle one request at a time, the rest of their share is overflow"""
+
+        self.assertEqual(pool_size(workers=4, concurrency=1, max_connections=20), (3, 1))
+
+    def test_pool_size_gevent_workers(self):
+        """Gevent workers are capped at their share of the connections"""
+
+        self.assertEqual(pool_size(workers=4, concurrency=500, max_connections=20), (4, 0))
+        self.assertEqual(pool_size(workers=20, concurrency=500, max_connections=20), (1, 0))
+
+    def test_engine_options(self):
+        options = engine_options({"WEB_CONCURRENCY": "2", "GUNICORN_WORKER_CLASS": "gthread",
+                                  "GUNICORN_THREADS": "4", "DB_MAX_CONNECTIONS": "22"})
+
+        self.assertIs(options["poolclass"], TimedQueuePool)
+        self.assertEqual(options["pool_size"], 6)
+        self.assertEqual(options["max_overflow"], 4)
+
+    def test_engine_options_overrides(self):
+        options = engine_options({"DB_POOL_SIZE": "7", "DB_MAX_OVERFLOW": "0", "DB_POOL_TIMEOUT": "3"})
+
+        self.assertEqual((options["pool_size"], options["max_overflow"], options["pool_timeout"]), (7, 0, 3))
+
+    def test_engine_options_pgbouncer(self):
+        options = engine_options({"DB_POOL_MODE": "pgbouncer"})
+
+        self.assertEqual(options, {"poolclass": NullPool, "pool_pre_ping": True})
+
+    def test_checkout_wait_recorded(self):
+        """Every checkout from the pool is timed"""
+
+        engine = create_engine('sqlite://', poolclass=TimedQueuePool, pool_size=1, max_overflow=0)
+        before = metrics.db_pool_wait_seconds.values.get((), [0, 0])[-2]
+
+        with engine.connect():
+            pass
+
+        self.assertEqual(metrics.db_pool_wait_seconds.values[()][-2], before + 1)
@@ -0,0 +1,94 @@
+"""Card image proxy tests."""
+
+# run these tests with:
+# python -m unittest test_images.py
+
+import io
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from PIL import Image
+
+from images import card_image, make_thumbnail, ImageCache, NAME_PATTERN, THUMBNAIL_WIDTH
+
+
+def png(width=245, height=342):
+    """Return the bytes of a plain PNG image."""
+
+    output = io.BytesIO()
+    Image.new('RGBA', (width, height), (255, 204, 0, 255)).save(output, 'PNG')
+    return output.getvalue()
+
+
+class ImageProxyTestCase(TestCase):
+    """Test the image proxy helpers and disk cache."""
+
+    def test_card_image(self):
+        """API image urls are rewritten to the proxy, anything else is left alone"""
+
+        self.assertEqual(card_image('https://images.pokemontcg.io/swsh4/44.png'), f'/images/swsh4/44.png?size=thumb&w={THUMBNAIL_WIDTH}')
+        self.assertEqual(card_image('https://images.pokemontcg.io/swsh4/44_hires.png', 'large'), '/images/swsh4/44_hires.png?size=large')
+        self.assertEqual(card_image('https://example.com/44.png'), 'https://example.com/44.png')
+
+    def test_names_cannot_leave_the_cache(self):
+        """Set ids and file names like '..' are rejected"""
+
+        self.assertFalse(NAME_PATTERN.match('..'))
+        self.assertFalse(NAME_PATTERN.match('.hidden'))
+        self.assertTrue(NAME_PATTERN.match('swshp'))
+
+    def test_make_thumbnail(self):
+        """Thumbnails are WebP images, scaled down to THUMBNAIL_WIDTH"""
+
+        thumbnail = Image.open(io.BytesIO(make_thumbnail(png(734, 1024))))
+
+        self.assertEqual(thumbnail.format, 'WEBP')
+        self.assertEqual(thumbnail.width, THUMBNAIL_WIDTH)
+        self.assertEqual(thumbnail.height, round(1024 * THUMBNAIL_WIDTH / 734))
+
+    def test_make_thumbnail_no_upscaling(self):
+        """Images narrower than THUMBNAIL_WIDTH keep their size"""
+
+        thumbnail = Image.open(io.BytesIO(make_thumbnail(png(245, 342))))
+
+        self.assertEqual(thumbnail.size, (245, 342))
+
+    def test_cache_evicts_least_recently_used(self):
+        """Old images are removed once the cache is over its size limit"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ImageCache(directory, max_bytes=len(png()) * 2)
+            cache.download = lambda set_id, filename: png()
+
+            first = cache.get('base1', '1.png', 'small')
+            os.utime(first, (0, 0)) # make it the oldest
+            cache.get('base1', '2.png', 'small')
+            cache.get('base1', '3.png', 'small')
+
+            self.assertFalse(os.path.exists(first))
+            self.assertTrue(os.path.exists(cache.path('base1', '3.png', 'small')))
+
+    def test_concurrent_misses_download_once(self):
+        """Requests for an image which is being downloaded wait for that download"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ImageCache(directory)
+            downloads = []
+
+            def download(set_id, filename):
+                downloads.append(filename)
+                time.sleep(0.05)
+                return png()
+
+            cache.download = download
+
+            threads = [threading.Thread(target=cache.get, args=('base1', '1.png', 'thumb')) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(downloads, ['1.png'])
+            self.assertTrue(os.path.exists(cache.path('base1', '1.png', 'thumb')))
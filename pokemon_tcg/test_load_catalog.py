@@ -0,0 +1,68 @@
+"""Bulk catalog loader tests."""
+
+# run these tests with:
+# python -m unittest test_load_catalog.py
+
+import csv
+import io
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from load_catalog import iter_json_array, array_literal, copy_rows, find_dump_files, COLUMNS
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'benchmark', 'fixtures', 'cards.json')
+
+
+class LoadCatalogTestCase(TestCase):
+    """Test reading a Pokemon TCG data dump."""
+
+    def setUp(self):
+        with open(FIXTURES) as f:
+            self.cards = json.load(f)
+
+    def test_iter_json_array(self):
+        """Items are parsed one at a time, even when they span several chunks"""
+
+        text = json.dumps(self.cards, indent=2)
+
+        for chunk_size in (7, 100, 100000):
+            self.assertEqual(list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)), self.cards)
+
+    def test_iter_json_array_empty(self):
+        self.assertEqual(list(iter_json_array(io.StringIO(' [ ] '))), [])
+
+    def test_iter_json_array_invalid(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('{"id": "base1-4"}')))
+
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('[{"id": "base1-4"}, {"id": '), chunk_size=4))
+
+    def test_array_literal(self):
+        self.assertEqual(array_literal(['Fire', 'Water']), '{"Fire","Water"}')
+        self.assertEqual(array_literal(['a"b\\c']), '{"a\\"b\\\\c"}')
+        self.assertIsNone(array_literal(None))
+
+    def test_copy_rows(self):
+        rows = list(csv.reader(copy_rows(self.cards[:2])))
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][COLUMNS.index('id')], self.cards[0]['id'])
+        self.assertEqual(json.loads(rows[0][COLUMNS.index('data')]), self.cards[0])
+
+        # the dump has no prices, its cards are left to be synced from the API
+        self.assertEqual(rows[0][COLUMNS.index('synced_at')], '')
+
+    def test_find_dump_files(self):
+        with tempfile.TemporaryDirectory() as path:
+            os.makedirs(os.path.join(path, 'cards', 'en'))
+            os.makedirs(os.path.join(path, 'sets'))
+            for name in ('cards/en/base1.json', 'cards/en/swsh4.json', 'sets/en.json'):
+                open(os.path.join(path, name), 'w').close()
+
+            card_files, sets_file = find_dump_files(path)
+
+            self.assertEqual([os.path.basename(name) for name in card_files], ['base1.json', 'swsh4.json'])
+            self.assertEqual(sets_file, os.path.join(path, 'sets', 'en.json'))
@@ -0,0 +1,68 @@
+"""Password hashing tests."""
+
+# run these tests with:
+# python -m unittest test_passwords.py
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from unittest import TestCase
+
+from passwords import PasswordHasher, PasswordHasherBusy, START_METHOD
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the hashing pool's admission control."""
+
+    def setUp(self):
+        self.hasher = PasswordHasher(rounds=4, workers=1, max_pending=1, queue_timeout=1, timeout=0.05)
+        # threads instead of processes, so the test can hold a hash back
+        self.hasher._pool = ThreadPoolExecutor(max_workers=1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.hasher._pool.shutdown(wait=True)
+
+    def slow(self):
+        self.release.wait(5)
+        return True
+
+    def test_hash_and_check(self):
+        hashed = self.hasher.hash("password")
+
+        self.assertTrue(self.hasher.check(hashed, "password"))
+        self.assertFalse(self.hasher.check(hashed, "wrong"))
+
+    def test_timeout_keeps_slot(self):
+        """A hash which timed out still holds its slot until it finishes"""
+
+        self.hasher.queue_timeout = 0
+
+        with self.assertRaises(PasswordHasherBusy):
+            self.hasher._run(self.slow)
+
+        # the first hash is still running, so there is no room for another
+        with self.assertRaises(PasswordHasherBusy):
+            self.hasher._run(self.slow)
+
+        self.release.set()
+        self.hasher._pool.shutdown(wait=True)
+        self.hasher._pool = ThreadPoolExecutor(max_workers=1)
+
+        self.assertTrue(self.hasher._run(lambda: True))
+
+
+class ProcessPoolTestCase(TestCase):
+    """Test hashing in a real process pool."""
+
+    def test_hash_in_process_pool(self):
+        hasher = PasswordHasher(rounds=4, workers=1)
+
+        try:
+            hashed = hasher.hash("password")
+
+            self.assertTrue(hasher.check(hashed, "password"))
+            self.assertEqual(hasher._pool._mp_context.get_start_method(), START_METHOD)
+        finally:
+            hasher._pool.shutdown(wait=True)
+
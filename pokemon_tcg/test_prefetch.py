@@ -0,0 +1,114 @@
+"""Card details prefetch tests."""
+
+# run these tests with:
+# python -m unittest test_prefetch.py
+
+import json
+import os
+from unittest import TestCase
+
+from flask import Flask
+
+import rendering
+from cache import TTLCache
+from prefetch import Prefetcher, TokenBucket
+from records import CardRecord
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'benchmark', 'fixtures', 'cards.json')
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTestCase(TestCase):
+    """Test the upstream request budget."""
+
+    def test_take(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+
+        clock.now = 0.5 # one more token
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+
+        clock.now = 60 # never more than the burst
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+
+
+class PrefetcherTestCase(TestCase):
+    """Test warming the details of search results."""
+
+    def setUp(self):
+        with open(FIXTURES) as f:
+            self.cards = [CardRecord.from_api(card) for card in json.load(f)]
+
+        self.app = Flask(__name__)
+        rendering.init_app(self.app)
+        rendering.fragment_cache.clear()
+
+        self.card_cache = TTLCache('test_prefetch', ttl=60)
+        self.loaded = []
+
+    def load(self, card_id):
+        self.loaded.append(card_id)
+        card = next(card for card in self.cards if card.id == card_id)
+        self.card_cache.set(card_id, card)
+        return card
+
+    def prefetch(self, cards, from_catalog=True, **kwargs):
+        prefetcher = Prefetcher(self.card_cache, self.load, app=self.app, **kwargs)
+        prefetcher.schedule(cards, from_catalog)
+
+        if prefetcher._pool is not None:
+            prefetcher._pool.shutdown(wait=True)
+
+        return prefetcher
+
+    def test_catalog_results(self):
+        """Results from the catalog are cached as they are, without loading them again"""
+
+        prefetcher = self.prefetch(self.cards, top_n=2)
+
+        self.assertEqual(self.loaded, [])
+        self.assertTrue(prefetcher.is_warm(self.cards[0]))
+        self.assertTrue(prefetcher.is_warm(self.cards[1]))
+        self.assertFalse(prefetcher.is_warm(self.cards[2]))
+        self.assertIn(rendering.card_version(self.cards[0]), rendering.fragment_cache)
+
+    def test_api_results_budget(self):
+        """Results from the API are loaded, up to the upstream budget"""
+
+        budget = TokenBucket(rate=1, burst=2, clock=FakeClock())
+        self.prefetch(self.cards, from_catalog=False, top_n=4, upstream_budget=budget)
+
+        self.assertEqual(self.loaded, [self.cards[0].id, self.cards[1].id])
+        self.assertNotIn(self.cards[2].id, self.card_cache)
+
+    def test_warm_cache(self):
+        """Nothing is scheduled when the cards are already warm"""
+
+        self.prefetch(self.cards, from_catalog=False, top_n=2)
+        self.loaded.clear()
+
+        prefetcher = self.prefetch(self.cards, from_catalog=False, top_n=2)
+
+        self.assertEqual(self.loaded, [])
+        self.assertIsNone(prefetcher._pool)
+
+    def test_busy(self):
+        """Searches are skipped while too many are waiting"""
+
+        prefetcher = Prefetcher(self.card_cache, self.load, app=self.app, max_pending=1)
+        prefetcher._slots.acquire() # another search is being warmed
+
+        prefetcher.schedule(self.cards)
+
+        self.assertIsNone(prefetcher._pool)
+        self.assertNotIn(self.cards[0].id, self.card_cache)
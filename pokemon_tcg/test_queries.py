@@ -0,0 +1,87 @@
+"""Query counting tests."""
+
+# run these tests with:
+# python -m unittest test_queries.py
+
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import Column, ForeignKey, Integer, Table, create_engine, text
+from sqlalchemy.orm import Session, declarative_base, relationship
+
+import queries
+from queries import count_queries, QueryBudgetMixin
+
+Base = declarative_base()
+
+user_cards = Table('user_cards', Base.metadata,
+                   Column('user_id', ForeignKey('users.id')), Column('card_id', ForeignKey('cards.id')))
+
+
+class User(Base):
+    __tablename__ = 'users'
+    id = Column(Integer, primary_key=True)
+    favorites = relationship('Card', secondary=user_cards)
+
+
+class Card(Base):
+    __tablename__ = 'cards'
+    id = Column(Integer, primary_key=True)
+
+
+class QueryCountTestCase(QueryBudgetMixin, TestCase):
+    """Test counting queries and spotting N+1 patterns."""
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+
+        # installs the engine/session events
+        self.app = Flask(__name__)
+        self.app.config['QUERY_WARNINGS'] = True
+        queries.init_app(self.app)
+
+        self.session = Session(self.engine)
+        self.session.add_all([User(id=1), User(id=2)])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_count_queries(self):
+        with count_queries() as log:
+            self.session.execute(text('SELECT 1'))
+            self.session.execute(text('SELECT 2'))
+
+        self.assertEqual(len(log), 2)
+        self.assertEqual(log.statements, ['SELECT 1', 'SELECT 2'])
+
+    def test_lazy_loads(self):
+        """Loading a relationship for each user in a loop is an N+1"""
+
+        with count_queries() as log:
+            for user in self.session.query(User).all():
+                user.favorites
+
+        self.assertEqual(log.repeated_lazy_loads(), {'User.favorites': 2})
+
+    def test_assert_max_queries(self):
+        with self.assertMaxQueries(1):
+            self.session.execute(text('SELECT 1'))
+
+        with self.assertRaises(AssertionError):
+            with self.assertMaxQueries(1):
+                self.session.execute(text('SELECT 1'))
+                self.session.execute(text('SELECT 2'))
+
+    def test_warning_in_request(self):
+        """Requests which lazy load a relationship more than once log a warning"""
+
+        @self.app.route('/favorites')
+        def favorites():
+            return str(sum(len(user.favorites) for user in self.session.query(User).all()))
+
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            self.app.test_client().get('/favorites')
+
+        self.assertIn('User.favorites', logs.output[0])
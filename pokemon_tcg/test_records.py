@@ -0,0 +1,55 @@
+"""Card record tests."""
+
+# run these tests with:
+# python -m unittest test_records.py
+
+import json
+import os
+from unittest import TestCase
+
+from cache import estimate_size
+from records import CardRecord, Attack, Prices
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'benchmark', 'fixtures', 'cards.json')
+
+
+class CardRecordTestCase(TestCase):
+    """Test parsing API payloads into card records."""
+
+    def setUp(self):
+        with open(FIXTURES) as f:
+            self.payload = json.load(f)[0]
+
+    def test_from_api(self):
+        card = CardRecord.from_api(self.payload)
+
+        self.assertEqual(card.id, "swshp-SWSH020")
+        self.assertEqual(card.name, "Pikachu")
+        self.assertEqual(card.subtype, "Basic")
+        self.assertEqual(card.types, ("Lightning",))
+        self.assertEqual(card.attacks, (Attack("Thunder Jolt", ("Lightning",), "30x",
+                                               "Flip a coin until you get tails. This attack does 30 damage for each heads."),))
+        self.assertEqual(card.weakness_type, "Fighting")
+        self.assertEqual(card.pokedex_number, 25)
+        self.assertEqual(card.set_name, "SWSH Black Star Promos")
+        self.assertEqual(card.set_symbol, "https://images.pokemontcg.io/swshp/symbol.png")
+        self.assertEqual(card.holofoil, Prices(market=2.2, low=1.5, mid=2.75, high=9.99))
+
+    def test_from_api_minimal(self):
+        """Trainer/energy cards are missing most of the Pokemon fields"""
+
+        card = CardRecord.from_api({"id": "sv1-196", "name": "Ultra Ball", "supertype": "Trainer",
+                                    "images": {"small": "s.png", "large": "l.png"}})
+
+        self.assertEqual(card.image_small, "s.png")
+        self.assertIsNone(card.hp)
+        self.assertEqual(card.attacks, ())
+        self.assertIsNone(card.ability)
+        self.assertIsNone(card.holofoil)
+        self.assertIsNone(card.set_name)
+
+    def test_smaller_than_payload(self):
+        card = CardRecord.from_api(self.payload)
+
+        self.assertGreater(estimate_size(card), 0)
+        self.assertLess(estimate_size(card), estimate_size(self.payload))
@@ -0,0 +1,27 @@
+"""Database upgrade tests."""
+
+# run these tests with:
+# python -m unittest test_upgrade_db.py
+
+from unittest import TestCase
+
+from models import Card
+from upgrade_db import UPGRADE_STATEMENTS
+
+
+class UpgradeTestCase(TestCase):
+    """Test that the upgrade covers the current models."""
+
+    def test_card_columns(self):
+        """Every column added to `cards` since the first release is added by the upgrade"""
+
+        added = {column.name for column in Card.__table__.columns} - {'id', 'name'}
+        upgraded = {statement.split()[8] for statement in UPGRADE_STATEMENTS if statement.startswith('ALTER TABLE cards ADD COLUMN')}
+
+        self.assertEqual(added, upgraded)
+
+    def test_idempotent(self):
+        """Every statement can run again on an upgraded database"""
+
+        for statement in UPGRADE_STATEMENTS:
+            self.assertIn('IF NOT EXISTS', statement)
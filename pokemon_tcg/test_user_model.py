@@ -8,6 +8,7 @@ from unittest import TestCase
 from sqlalchemy import exc
 
 from models import db, User
+from passwords import hasher
 
 # testing database
 # set this before importing the app
@@ -143,4 +144,16 @@ class UserModelTestCase(TestCase):
         
         self.assertFalse(User.authenticate(self.user1.username, "wrongpassword"))
 
+    def test_authentication_rehashes_password(self):
+        """Passwords hashed with a different work factor are rehashed on login"""
 
+        old_rounds = hasher.rounds
+        hasher.rounds = 4
+
+        try:
+            user = User.authenticate(self.user1.username, "password")
+
+            self.assertTrue(user.password.startswith("$2b$04$"))
+            self.assertEqual(User.authenticate(self.user1.username, "password"), user)
+        finally:
+            hasher.rounds = old_rounds
@@ -3,19 +3,23 @@
 # run these tests like:
 # python -m unittest test_user_views.py
 
+import datetime
 import os
 from unittest import TestCase
+from unittest.mock import patch
 from models import db, connect_db, User, Card, Favorite
+from queries import QueryBudgetMixin
 
 os.environ['DATABASE_URL'] = "postgresql:///pokemon-tcg-test"
 
-from app import app, CURR_USER_KEY
+from catalog import CatalogWriteError
+from app import app, CURR_USER_KEY, IDENTITY_KEY, FavoriteIds
 
 # Don't have WTForms use CSRF at all, since it's a pain to test
 app.config['WTF_CSRF_ENABLED'] = False
 
 
-class UserViewTestCase(TestCase):
+class UserViewTestCase(QueryBudgetMixin, TestCase):
     """Test views for Users."""
     
     def setUp(self):
@@ -54,6 +58,43 @@ class UserViewTestCase(TestCase):
             self.assertEqual(res.status_code, 200)
             self.assertIn("testuser", str(res.data))
     
+    def test_identity_saved_in_session(self):
+        """The user is only queried until their identity is saved in the session"""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            client.get("/")
+
+            with client.session_transaction() as session:
+                self.assertEqual(session[IDENTITY_KEY]["username"], "testuser")
+
+            with self.assertMaxQueries(0):
+                res = client.get("/logout", follow_redirects=False)
+
+            self.assertEqual(res.status_code, 302)
+
+    def test_deleted_user_logged_out(self):
+        """A session whose user was deleted elsewhere is logged out instead of failing"""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+                session[IDENTITY_KEY] = {"id": self.testuser_id, "username": "testuser", "profile_image": None}
+
+            db.session.delete(User.query.get(self.testuser_id))
+            db.session.commit()
+
+            res = client.get("/user/edit")
+            self.assertEqual(res.status_code, 302)
+
+            res = client.post("/user/delete")
+            self.assertEqual(res.status_code, 302)
+
+            with client.session_transaction() as session:
+                self.assertNotIn(CURR_USER_KEY, session)
+
     def test_show_user_profile_invalid(self):
         """Redirect to home if user is not logged in"""
         with self.client as client:
@@ -138,6 +179,107 @@ class UserViewTestCase(TestCase):
             self.assertEqual(len(favorites), 0)
 
 
+    def test_favorite_card_json(self):
+        """Toggling a favorite through the JSON endpoint returns the new state"""
+
+        self.setup_favorites()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            res = client.post("/api/cards/two/favorite")
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json, {"card_id": "two", "favorited": True})
+            self.assertEqual(Favorite.query.filter(Favorite.card_id=="two").count(), 1)
+
+            res = client.post("/api/cards/two/favorite")
+
+            self.assertEqual(res.json, {"card_id": "two", "favorited": False})
+            self.assertEqual(Favorite.query.filter(Favorite.card_id=="two").count(), 0)
+
+    def test_favorite_card_query_budget(self):
+        """Toggling a favorite loads the user, then deletes/inserts the favorite"""
+
+        self.setup_favorites()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            with self.assertMaxQueries(3):
+                client.post("/api/cards/two/favorite")
+
+    def test_favorite_exists(self):
+        """Favorites are looked up without loading the cards"""
+
+        self.setup_favorites()
+
+        self.assertTrue(Favorite.exists(self.testuser_id, "one"))
+        self.assertFalse(Favorite.exists(self.testuser_id, "two"))
+        self.assertEqual(Favorite.card_ids(self.testuser_id), ["one"])
+
+    def test_favorite_ids_order(self):
+        """Favorite ids are in the order they were added, not the order of the ids"""
+
+        self.setup_favorites()
+        Favorite.query.filter_by(card_id="one").update({"created_at": datetime.datetime(2022, 3, 2)})
+        db.session.add(Favorite(user_id=self.testuser_id, card_id="two", created_at=datetime.datetime(2022, 3, 1)))
+        db.session.commit()
+
+        favorite_ids = FavoriteIds(Favorite.card_ids(self.testuser_id))
+
+        self.assertEqual(favorite_ids.ids, ("two", "one"))
+        self.assertIn("one", favorite_ids)
+        self.assertNotIn("three", favorite_ids)
+
+    def test_favorite_count_after_toggle(self):
+        """The cached favorite ids are replaced when a favorite is toggled"""
+
+        self.setup_favorites()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            res = client.get("/user")
+            self.assertIn('<p id="number-favorites" class="text-info">1</p>', str(res.data))
+
+            client.post("/api/cards/two/favorite")
+
+            res = client.get("/user")
+            self.assertIn('<p id="number-favorites" class="text-info">2</p>', str(res.data))
+
+    def test_favorite_missing_card(self):
+        """Favoriting a card which isn't in the database is a 404"""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            res = client.post("/api/cards/does-not-exist/favorite")
+
+            self.assertEqual(res.status_code, 404)
+            self.assertEqual(res.json, {"error": "Card not found."})
+
+    def test_favorite_card_save_failed(self):
+        """A card which can't be saved makes the favorite unavailable, not a server error"""
+
+        self.setup_favorites()
+        writer = app.extensions['card_writer']
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            with patch.object(writer, 'flush', side_effect=CatalogWriteError("no cards table")):
+                res = client.post("/api/cards/two/favorite")
+                self.assertEqual(res.status_code, 503)
+
+                res = client.post("/cards/two/favorite")
+                self.assertEqual(res.status_code, 302)
+
     def test_favorite_card_as_unauthorized_user(self):
         """Trying to favorite a card while not signed in"""
         self.setup_favorites()
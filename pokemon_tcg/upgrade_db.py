@@ -0,0 +1,58 @@
+from sqlalchemy import text
+from models import db
+
+############################################################################################
+# DATABASE UPGRADE
+#
+# Brings a database created before the local card catalog up to date, without losing any
+# users or favorites (seed.py drops every table, it is only for new databases):
+#
+#   python upgrade_db.py
+#
+# Every statement checks whether it is still needed, so it is safe to run on every deploy.
+
+UPGRADE_STATEMENTS = [
+    # the local card catalog (catalog.py)
+    "ALTER TABLE cards ADD COLUMN IF NOT EXISTS supertype TEXT",
+    "ALTER TABLE cards ADD COLUMN IF NOT EXISTS hp TEXT",
+    "ALTER TABLE cards ADD COLUMN IF NOT EXISTS types TEXT[]",
+    "ALTER TABLE cards ADD COLUMN IF NOT EXISTS image_small TEXT",
+    "ALTER TABLE cards ADD COLUMN IF NOT EXISTS image_large TEXT",
+    "ALTER TABLE cards ADD COLUMN IF NOT EXISTS set_id TEXT",
+    "ALTER TABLE cards ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE cards ADD COLUMN IF NOT EXISTS data JSONB",
+    "ALTER TABLE cards ADD COLUMN IF NOT EXISTS synced_at TIMESTAMP WITHOUT TIME ZONE",
+
+    # bookkeeping for the catalog sync, bulk loader and featured cards
+    """CREATE TABLE IF NOT EXISTS app_state (
+        key TEXT PRIMARY KEY,
+        value JSONB NOT NULL,
+        updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+    )""",
+
+    # favorites are listed in the order they were added (existing ones are all dated now)
+    "ALTER TABLE favorites ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()",
+
+    # card name search and autocomplete
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_cards_name_trgm ON cards USING gin (name gin_trgm_ops)",
+]
+
+
+def upgrade(log=print):
+    """Run the upgrade statements in one transaction."""
+
+    for statement in UPGRADE_STATEMENTS:
+        db.session.execute(text(statement))
+        log(' '.join(statement.split())[:80])
+
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        upgrade()
+
+    print("Database is up to date.")